@@ -1,12 +1,24 @@
 import logging
 import logging.config
+import multiprocessing
+import sys
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import typer
 
+from furniture_mover.async_couch import Engine
+from furniture_mover.batching import DEFAULT_LATENCY_GOAL
+from furniture_mover.compression import Compression, resolve_compression
 from furniture_mover.config import Config
 from furniture_mover.furniture_mover import FurnitureMover
+from furniture_mover.profiling import Profile, Profiler, format_spans
+from furniture_mover.stats import (
+    STATS,
+    ProgressReporter,
+    write_prometheus_file,
+    write_stats_file,
+)
 
 app = typer.Typer()
 
@@ -17,6 +29,50 @@ if Path("furniture_mover.ini").exists():
     logging.config.fileConfig("furniture_mover.ini")
 
 
+@app.callback()
+def main(
+    ctx: typer.Context,
+    stats_file: Optional[Path] = typer.Option(None),
+    prometheus_file: Optional[Path] = typer.Option(None),
+    progress: bool = typer.Option(False),
+    profile: Optional[Profile] = typer.Option(None),
+    profile_file: Optional[Path] = typer.Option(None),
+) -> None:
+    STATS.reset()
+    reporter = None
+    if progress:
+        reporter = ProgressReporter(lambda line: typer.echo(line, err=True))
+        reporter.start()
+    profiler = None
+    if profile is not None:
+        profiler = Profiler(profile, profile_file)
+        profiler.start()
+    ctx.obj = profiler
+
+    # runs after the command, also when it exits with an error
+    def finish() -> None:
+        if reporter is not None:
+            reporter.stop()
+        try:
+            if profiler is not None:
+                profiler.stop()
+                for line in format_spans():
+                    typer.echo(line, err=True)
+                typer.echo(
+                    f"wrote {profiler.profile.value} profile to {profiler.filepath}",
+                    err=True,
+                )
+            if stats_file is not None:
+                write_stats_file(stats_file)
+            if prometheus_file is not None:
+                write_prometheus_file(prometheus_file)
+        except Exception as e:
+            logger.exception(e)
+            sys.exit(f"Exception opening or writing file: {str(e)}")
+
+    ctx.call_on_close(finish)
+
+
 @app.command("import")
 def import_data(
     filepath: Path,
@@ -29,6 +85,21 @@ def import_data(
     db_exists_ok_if_empty: bool = typer.Option(True),
     same_revision: bool = typer.Option(True),
     cert_verify: bool = typer.Option(True),
+    batch_size: int = typer.Option(1000, min=1),
+    batch_bytes: Optional[int] = typer.Option(None, min=1),
+    replay_revisions: bool = typer.Option(False),
+    workers: int = typer.Option(1, min=1),
+    delta: bool = typer.Option(False),
+    resume: bool = typer.Option(False),
+    checkpoint_file: Optional[Path] = typer.Option(None),
+    compression: Compression = typer.Option(Compression.auto),
+    start_id: Optional[str] = typer.Option(None),
+    end_id: Optional[str] = typer.Option(None),
+    index_file: Optional[Path] = typer.Option(None),
+    engine: Engine = typer.Option(Engine.sync),
+    http_compression: bool = typer.Option(False),
+    adaptive_batching: bool = typer.Option(False),
+    batch_latency: float = typer.Option(DEFAULT_LATENCY_GOAL, min=0.01),
 ) -> None:
     logger.info("import got called")
     config = Config(
@@ -38,11 +109,32 @@ def import_data(
         proxy=proxy,
         timeout=timeout,
         cert_verify=cert_verify,
+        pool_maxsize=workers,
+        http_compression=http_compression,
     )
 
     fm = FurnitureMover(config)
     try:
-        fm.insert_all_docs(filepath, db, same_revision, db_exists_ok_if_empty)
+        fm.insert_all_docs(
+            filepath,
+            db,
+            same_revision,
+            db_exists_ok_if_empty,
+            batch_size=batch_size,
+            batch_bytes=batch_bytes,
+            replay_revisions=replay_revisions,
+            workers=workers,
+            delta=delta,
+            resume=resume,
+            checkpoint_file=checkpoint_file,
+            compression=compression,
+            start_id=start_id,
+            end_id=end_id,
+            index_file=index_file,
+            engine=engine,
+            adaptive_batching=adaptive_batching,
+            batch_latency=batch_latency,
+        )
     finally:
         fm.close()
 
@@ -57,8 +149,35 @@ def export_data(
     proxy: Optional[str] = typer.Option(None),
     timeout: float = typer.Option(3),
     cert_verify: bool = typer.Option(True),
+    page_size: Optional[int] = typer.Option(None, min=1),
+    stream: bool = typer.Option(False),
+    workers: int = typer.Option(1, min=1),
+    since: Optional[str] = typer.Option(None),
+    since_checkpoint: Optional[Path] = typer.Option(None),
+    checkpoint_file: Optional[Path] = typer.Option(None),
+    resume: bool = typer.Option(False),
+    compression: Compression = typer.Option(Compression.auto),
+    compression_level: Optional[int] = typer.Option(None, min=0, max=9),
+    index: bool = typer.Option(False),
+    engine: Engine = typer.Option(Engine.sync),
+    http_compression: bool = typer.Option(False),
 ) -> None:
     logger.info("export got called")
+    _check_index(index, filepath, compression)
+    if since is not None and since_checkpoint is not None:
+        logger.critical("--since can not be combined with --since-checkpoint.")
+        sys.exit("--since can not be combined with --since-checkpoint.")
+    changes = since is not None or since_checkpoint is not None
+    if changes and (stream or workers > 1 or resume or engine != Engine.sync):
+        logger.critical(
+            "--since and --since-checkpoint can not be combined with --stream, "
+            "--workers, --resume or --engine."
+        )
+        sys.exit(
+            "--since and --since-checkpoint can not be combined with --stream, "
+            "--workers, --resume or --engine."
+        )
+
     config = Config(
         url=url,
         user=user,
@@ -66,26 +185,221 @@ def export_data(
         proxy=proxy,
         timeout=timeout,
         cert_verify=cert_verify,
+        pool_maxsize=workers,
+        http_compression=http_compression,
     )
 
     fm = FurnitureMover(config)
     try:
-        fm.save_all_docs(filepath, db)
+        if changes:
+            fm.save_changes(
+                filepath,
+                db,
+                since,
+                since_checkpoint,
+                checkpoint_file=checkpoint_file,
+                page_size=page_size,
+                compression=compression,
+                compression_level=compression_level,
+                index=index,
+            )
+        else:
+            fm.save_all_docs(
+                filepath,
+                db,
+                page_size=page_size,
+                stream=stream,
+                workers=workers,
+                resume=resume,
+                checkpoint_file=checkpoint_file,
+                compression=compression,
+                compression_level=compression_level,
+                engine=engine,
+                index=index,
+            )
+    finally:
+        fm.close()
+
+
+@app.command("copy")
+def copy(
+    source: str,
+    target: str,
+    source_user: Optional[str] = typer.Option(None),
+    source_password: Optional[str] = typer.Option(None),
+    target_user: Optional[str] = typer.Option(None),
+    target_password: Optional[str] = typer.Option(None),
+    proxy: Optional[str] = typer.Option(None),
+    timeout: float = typer.Option(3),
+    cert_verify: bool = typer.Option(True),
+    http_compression: bool = typer.Option(False),
+    source_proxy: Optional[str] = typer.Option(None),
+    source_timeout: Optional[float] = typer.Option(None),
+    source_cert_verify: Optional[bool] = typer.Option(
+        None, "--source-cert-verify/--no-source-cert-verify"
+    ),
+    source_http_compression: Optional[bool] = typer.Option(
+        None, "--source-http-compression/--no-source-http-compression"
+    ),
+    target_proxy: Optional[str] = typer.Option(None),
+    target_timeout: Optional[float] = typer.Option(None),
+    target_cert_verify: Optional[bool] = typer.Option(
+        None, "--target-cert-verify/--no-target-cert-verify"
+    ),
+    target_http_compression: Optional[bool] = typer.Option(
+        None, "--target-http-compression/--no-target-http-compression"
+    ),
+    db_exists_ok_if_empty: bool = typer.Option(True),
+    same_revision: bool = typer.Option(True),
+    replay_revisions: bool = typer.Option(False),
+    page_size: int = typer.Option(1000, min=1),
+    queue_size: int = typer.Option(2, min=1),
+) -> None:
+    logger.info("copy got called")
+    source_url, source_db = _split_db_url(source)
+    target_url, target_db = _split_db_url(target)
+    # the --source-* and --target-* options override the ones of both sides
+    source_config = Config(
+        url=source_url,
+        user=source_user,
+        password=source_password,
+        proxy=proxy if source_proxy is None else source_proxy,
+        timeout=timeout if source_timeout is None else source_timeout,
+        cert_verify=cert_verify if source_cert_verify is None else source_cert_verify,
+        http_compression=(
+            http_compression
+            if source_http_compression is None
+            else source_http_compression
+        ),
+    )
+    target_config = Config(
+        url=target_url,
+        user=target_user,
+        password=target_password,
+        proxy=proxy if target_proxy is None else target_proxy,
+        timeout=timeout if target_timeout is None else target_timeout,
+        cert_verify=cert_verify if target_cert_verify is None else target_cert_verify,
+        http_compression=(
+            http_compression
+            if target_http_compression is None
+            else target_http_compression
+        ),
+    )
+
+    fm = FurnitureMover(source_config)
+    try:
+        fm.copy_docs(
+            source_db,
+            target_config,
+            target_db,
+            page_size=page_size,
+            same_revision=same_revision,
+            db_exists_ok_if_empty=db_exists_ok_if_empty,
+            replay_revisions=replay_revisions,
+            queue_size=queue_size,
+        )
     finally:
         fm.close()
 
 
 @app.command("export_from_all_docs_file")
-def export_data_from_all_docs_file(all_docs_filepath: Path, filepath: Path) -> None:
+def export_data_from_all_docs_file(
+    all_docs_filepath: Path,
+    filepath: Path,
+    compression: Compression = typer.Option(Compression.auto),
+    compression_level: Optional[int] = typer.Option(None, min=0, max=9),
+    index: bool = typer.Option(False),
+) -> None:
     logger.info("export_from_all_docs_file got called")
-    FurnitureMover.from_all_docs_file(all_docs_filepath, filepath)
+    _check_index(index, filepath, compression)
+    FurnitureMover.from_all_docs_file(
+        all_docs_filepath, filepath, compression, compression_level, index
+    )
 
 
 @app.command("filter")
-def filter(filter_file: Path, infile: Path) -> None:
+def filter(
+    ctx: typer.Context,
+    filter_file: Path,
+    infile: Path,
+    compression: Compression = typer.Option(Compression.auto),
+    compression_level: Optional[int] = typer.Option(None, min=0, max=9),
+    unmatched_file: Optional[Path] = typer.Option(None),
+    workers: int = typer.Option(1, min=1),
+) -> None:
     logger.info("filter got called")
-    FurnitureMover.filter_infile(filter_file, infile)
+    # the workers of filter are processes, which the profiler does not see
+    profiler: Optional[Profiler] = ctx.obj
+    if workers > 1 and profiler is not None and profiler.profile == Profile.cpu:
+        logger.critical("--profile cpu can not be combined with filter --workers.")
+        sys.exit("--profile cpu can not be combined with filter --workers.")
+    FurnitureMover.filter_infile(
+        filter_file, infile, compression, compression_level, unmatched_file, workers
+    )
+
+
+@app.command("index")
+def index_data(filepath: Path, index_file: Optional[Path] = typer.Option(None)) -> None:
+    logger.info("index got called")
+    FurnitureMover.index_file(filepath, index_file)
+
+
+@app.command("lookup")
+def lookup(
+    filepath: Path,
+    doc_ids: List[str],
+    index_file: Optional[Path] = typer.Option(None),
+) -> None:
+    logger.info("lookup got called")
+    docs = FurnitureMover.lookup_docs(filepath, doc_ids, index_file)
+    for doc in docs:
+        if doc is not None:
+            typer.echo(doc)
+
+    missing = [doc_id for doc_id, doc in zip(doc_ids, docs) if doc is None]
+    if missing:
+        logger.warning(f"docs not found: {missing}")
+        sys.exit(f"docs not found: {missing}")
+
+
+@app.command("extract")
+def extract(
+    filepath: Path,
+    outfile: Path,
+    start_id: Optional[str] = typer.Option(None),
+    end_id: Optional[str] = typer.Option(None),
+    index_file: Optional[Path] = typer.Option(None),
+    compression: Compression = typer.Option(Compression.auto),
+    compression_level: Optional[int] = typer.Option(None, min=0, max=9),
+) -> None:
+    logger.info("extract got called")
+    FurnitureMover.extract_range(
+        filepath,
+        outfile,
+        start_id,
+        end_id,
+        index_file,
+        compression,
+        compression_level,
+    )
+
+
+def _split_db_url(db_url: str) -> Tuple[str, str]:
+    url, _, db = db_url.rstrip("/").rpartition("/")
+    if "://" not in url or not db:
+        logger.critical(f"{db_url} is not of the form URL/DB.")
+        sys.exit(f"{db_url} is not of the form URL/DB.")
+    return url, db
+
+
+def _check_index(index: bool, filepath: Path, compression: Compression) -> None:
+    if index and resolve_compression(filepath, compression) != Compression.none:
+        logger.critical("--index can not be used for compressed files.")
+        sys.exit("--index can not be used for compressed files.")
 
 
 if __name__ == "__main__":
+    # the pyinstaller builds start the pool workers of filter --workers through
+    # this executable
+    multiprocessing.freeze_support()
     app()
@@ -0,0 +1,427 @@
+import asyncio
+import gzip
+import json
+import logging
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from furniture_mover.batching import AdaptiveBatchSizer
+from furniture_mover.codec import dumps, loads
+from furniture_mover.config import Config
+from furniture_mover.couch import (
+    HTTP_COMPRESSION_LEVEL,
+    DocId,
+    TransferCounter,
+    _add_revision_histories,
+    _has_errors,
+    _plan_catch_up,
+    _plan_delta,
+    _record_inserted_revisions,
+    _record_updated_revisions,
+    _split_bulk_docs,
+    _split_target_revisions,
+)
+from furniture_mover.profiling import span
+from furniture_mover.stats import STATS, endpoint_name
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None  # type: ignore
+
+logger = logging.getLogger("couch")
+
+# the same retry strategy as the urllib3 Retry of CouchDb
+RETRIES = 3
+RETRY_STATUS = [429, 500, 502, 503, 504]
+BACKOFF_FACTOR = 1
+
+
+class Engine(str, Enum):
+    sync = "sync"
+    asyncio = "asyncio"
+
+
+class AsyncHTTPError(Exception):
+    def __init__(self, status: int, text: str) -> None:
+        super().__init__(f"{status} {text}")
+        self.status = status
+        self.text = text
+
+
+class AsyncCouchDb:
+    def __init__(self, config: Config) -> None:
+        if aiohttp is None:
+            logger.critical("The async engine needs aiohttp: pip install aiohttp")
+            sys.exit("The async engine needs aiohttp: pip install aiohttp")
+
+        self._config = config
+        self._base_url = config.url
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self.transfer = TransferCounter()
+        self.batch_sizer: Optional[AdaptiveBatchSizer] = None
+        self._gzip_requests = config.http_compression
+
+    async def __aenter__(self) -> "AsyncCouchDb":
+        auth = None
+        if self._config.user and self._config.password:
+            auth = aiohttp.BasicAuth(self._config.user, self._config.password)
+
+        # pool_maxsize bounds the number of requests in flight, like the
+        # connection pool of CouchDb does. Responses are decoded by _request, so
+        # their size on the wire can be counted.
+        self._session = aiohttp.ClientSession(
+            auth=auth,
+            headers={
+                "Content-Type": "application/json",
+                "Accept-Charset": "utf-8",
+                "Cache-Control": "no-cache",
+                "Accept-Encoding": (
+                    "gzip" if self._config.http_compression else "gzip, deflate"
+                ),
+            },
+            auto_decompress=False,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self._config.timeout,
+                sock_read=self._config.timeout,
+            ),
+            connector=aiohttp.TCPConnector(
+                limit=self._config.pool_maxsize,
+                ssl=self._config.cert_verify,
+            ),
+        )
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        logger.info(f"transfer of {self._base_url}: {self.transfer}")
+        if self._session is not None:
+            await self._session.close()
+
+    @contextmanager
+    def handle_web(self, raise_status: List[int] = []):
+        try:
+            yield
+
+        except AsyncHTTPError as e:
+            if e.status in raise_status:
+                raise e
+
+            if e.status == 401:
+                logger.critical("Unauthorized: User or Password is wrong or missing.")
+                sys.exit("Unauthorized: User or Password is wrong or missing.")
+            else:
+                logger.critical(
+                    f"Got unexpected status code {e.status} with message {e.text}"
+                )
+                sys.exit(f"Got unexpected status code {e.status} with message {e.text}")
+
+        except aiohttp.InvalidURL as e:
+            logger.exception(e)
+            sys.exit(f"Got an invalid url {str(e)}")
+
+        except (aiohttp.ServerTimeoutError, asyncio.TimeoutError) as e:
+            logger.exception(e)
+            sys.exit(
+                f"Timeout Error connecting with base_url {self._base_url} {str(e)}"
+            )
+
+        except aiohttp.ClientConnectionError as e:
+            logger.exception(e)
+            sys.exit(f"Error connecting with base_url {self._base_url} {str(e)}")
+
+        except Exception as e:
+            logger.exception(e)
+            sys.exit(f"Got unexpected exception: {str(e)}")
+
+    async def _request(self, method: str, path: str, **kwargs) -> bytes:
+        if not self._base_url.startswith(("http://", "https://")):
+            logger.critical(f"Got an invalid url with missing schema {self._base_url}")
+            sys.exit(f"Got an invalid url with missing schema {self._base_url}")
+
+        assert self._session is not None
+        if self._config.proxy:
+            kwargs["proxy"] = self._config.proxy
+
+        endpoint = endpoint_name(method, path)
+        for attempt in range(RETRIES + 1):
+            if attempt > 1:
+                await asyncio.sleep(BACKOFF_FACTOR * 2 ** (attempt - 1))
+            start = time.perf_counter()
+            try:
+                async with self._session.request(
+                    method, f"{self._base_url}{path}", **kwargs
+                ) as response:
+                    body = await response.read()
+                    status = response.status
+                    encoding = response.headers.get("Content-Encoding", "")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == RETRIES:
+                    raise
+                continue
+
+            wire_bytes = len(body)
+            if encoding == "gzip":
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            elif encoding == "deflate":
+                try:
+                    body = zlib.decompress(body)
+                except zlib.error:
+                    # some servers send deflate without the zlib header
+                    body = zlib.decompress(body, -zlib.MAX_WBITS)
+            self.transfer.add_received(wire_bytes, len(body))
+
+            if status in RETRY_STATUS and attempt < RETRIES:
+                continue
+            STATS.observe_request(
+                endpoint,
+                time.perf_counter() - start,
+                error=status >= 400,
+                retries=attempt,
+            )
+            if status >= 400:
+                raise AsyncHTTPError(status, body.decode("utf-8", errors="replace"))
+            return body
+
+        raise AssertionError("unreachable")
+
+    async def _post(
+        self, path: str, data: bytes, raise_status: List[int] = []
+    ) -> bytes:
+        if self._gzip_requests:
+            compressed = gzip.compress(data, HTTP_COMPRESSION_LEVEL)
+            try:
+                with self.handle_web(raise_status=[415] + raise_status):
+                    body = await self._request(
+                        "POST",
+                        path,
+                        data=compressed,
+                        headers={"Content-Encoding": "gzip"},
+                    )
+                    self.transfer.add_sent(len(compressed), len(data))
+                    return body
+            except AsyncHTTPError as e:
+                if e.status != 415:
+                    raise e
+                logger.warning(
+                    f"{self._base_url} does not accept gzip encoded requests, "
+                    "sending them uncompressed"
+                )
+                self._gzip_requests = False
+
+        with self.handle_web(raise_status=raise_status):
+            body = await self._request("POST", path, data=data)
+            self.transfer.add_sent(len(data), len(data))
+            return body
+
+    async def _post_bulk_docs(self, db: str, payload: dict) -> List[dict]:
+        data = dumps(payload)
+        start = time.perf_counter()
+        try:
+            body = await self._post(f"{db}/_bulk_docs", data, raise_status=[413])
+        except AsyncHTTPError:
+            first, last = _split_bulk_docs(
+                payload, len(data), self.batch_sizer, self._base_url
+            )
+            return await self._post_bulk_docs(db, first) + await self._post_bulk_docs(
+                db, last
+            )
+
+        if self.batch_sizer is not None:
+            self.batch_sizer.record(len(data), time.perf_counter() - start)
+        STATS.observe_batch(len(payload["docs"]), len(data))
+        return loads(body)
+
+    async def create_db(
+        self, db: str, exists_ok_if_empty: bool = True, exists_ok: bool = False
+    ) -> None:
+        logger.debug(
+            f"creating couch-db {db} with exists_ok_if_empty={exists_ok_if_empty} "
+            f"and exists_ok={exists_ok}"
+        )
+        try:
+            with self.handle_web(raise_status=[412]):
+                logger.info(f"creating couch-db {db}")
+                await self._request("PUT", db)
+        except AsyncHTTPError:
+            if exists_ok:
+                return
+            elif exists_ok_if_empty:
+                with self.handle_web():
+                    db_info = loads(await self._request("GET", db))
+                if db_info["doc_count"] == 0:
+                    return
+                else:
+                    logger.critical(f"Database {db} exists but is not empty. Aborting.")
+                    sys.exit(f"Database {db} exists but is not empty. Aborting.")
+            else:
+                logger.critical(f"Database {db} already exists. Aborting.")
+                sys.exit(f"Database {db} already exists. Aborting.")
+
+    async def _get_all_docs_rows(self, db: str, params: Dict[str, Any]) -> List[dict]:
+        with span("fetch_page"), self.handle_web():
+            logger.info(f"getting {db}/_all_docs with params {params}")
+            data = loads(await self._request("GET", f"{db}/_all_docs", params=params))
+
+        logger.debug("got data %s", data)
+        if "rows" not in data:
+            logger.critical(
+                f"got unexpected response, 'rows' missing in json. Response was {data}"
+            )
+            sys.exit(
+                f"got unexpected response, 'rows' missing in json. Response was {data}"
+            )
+        return data["rows"]
+
+    async def get_all_docs(
+        self,
+        db: str,
+        page_size: Optional[int] = None,
+        startkey: Optional[DocId] = None,
+        endkey: Optional[DocId] = None,
+    ) -> AsyncIterator[dict]:
+        params: Dict[str, Any] = {"include_docs": "true"}
+        if startkey is not None:
+            params["startkey"] = json.dumps(startkey)
+        if endkey is not None:
+            # endkey is exclusive, so adjacent ranges don't overlap
+            params["endkey"] = json.dumps(endkey)
+            params["inclusive_end"] = "false"
+
+        if page_size is None:
+            for row in await self._get_all_docs_rows(db, params):
+                yield row["doc"]
+            return
+
+        # paginate with limit/startkey, so only one page is held in memory. A page
+        # starts at the last id of the previous one, whose row is dropped, and
+        # has one more row for it. Not skip=1, that doc may be deleted meanwhile.
+        last_id: Optional[DocId] = None
+        while True:
+            params["limit"] = page_size if last_id is None else page_size + 1
+            rows = await self._get_all_docs_rows(db, params)
+            for row in rows:
+                if row["id"] != last_id:
+                    yield row["doc"]
+
+            if len(rows) < params["limit"]:
+                return
+
+            last_id = rows[-1]["id"]
+            params["startkey"] = json.dumps(last_id)
+
+    async def get_range_boundaries(self, db: str, parts: int) -> List[DocId]:
+        with self.handle_web():
+            data = loads(
+                await self._request("GET", f"{db}/_all_docs", params={"limit": 0})
+            )
+        total_rows = data["total_rows"]
+
+        # sample the doc id at every n-th position without fetching any docs
+        skips = sorted({part * total_rows // parts for part in range(1, parts)} - {0})
+        samples = await asyncio.gather(
+            *[self._get_all_docs_rows(db, {"limit": 1, "skip": skip}) for skip in skips]
+        )
+        boundaries: List[DocId] = []
+        for rows in samples:
+            if rows and (not boundaries or boundaries[-1] != rows[0]["id"]):
+                boundaries.append(rows[0]["id"])
+
+        logger.info(f"split {db} with {total_rows} rows at {boundaries}")
+        return boundaries
+
+    async def _get_current_revs(
+        self, db: str, doc_ids: List[DocId]
+    ) -> Dict[DocId, str]:
+        data = loads(await self._post(f"{db}/_all_docs", dumps({"keys": doc_ids})))
+
+        current_revs: Dict[DocId, str] = {}
+        for row in data["rows"]:
+            # missing docs only have an "error", deleted docs are marked as deleted
+            if "value" in row and not row["value"].get("deleted"):
+                current_revs[row["id"]] = row["value"]["rev"]
+        return current_revs
+
+    async def apply_bulk_docs(self, db: str, docs: List[dict]) -> None:
+        logger.debug("applying bulk docs: %s", docs)
+
+        current_revs = await self._get_current_revs(db, [doc["_id"] for doc in docs])
+        updates = _plan_delta(docs, current_revs)
+        if not updates:
+            return
+
+        doc_infos = await self._post_bulk_docs(db, {"docs": updates})
+        if _has_errors(doc_infos, "Error applying doc"):
+            sys.exit("Error applying docs")
+
+    async def replay_bulk_docs(self, db: str, docs: List[dict]) -> None:
+        logger.debug("replaying bulk docs with new_edits=false: %s", docs)
+        _add_revision_histories(docs)
+
+        doc_infos = await self._post_bulk_docs(db, {"docs": docs, "new_edits": False})
+        if _has_errors(doc_infos, "Error replaying doc"):
+            sys.exit("Error replaying docs")
+
+    async def insert_bulk_docs(
+        self,
+        db: str,
+        docs: List[dict],
+        same_revision: bool = True,
+        replay_revisions: bool = False,
+        existing_ok: bool = False,
+    ) -> None:
+        logger.debug(
+            f"inserting bulk docs with same_revision={same_revision}, "
+            f"replay_revisions={replay_revisions} and existing_ok={existing_ok}"
+        )
+
+        if same_revision and replay_revisions:
+            replay_docs = [doc for doc in docs if "_rev" in doc]
+            if replay_docs:
+                await self.replay_bulk_docs(db, replay_docs)
+
+            # docs without a revision can only be inserted the usual way
+            docs = [doc for doc in docs if "_rev" not in doc]
+            if not docs:
+                return
+
+        mapping_target_revnum, mapping_docid_to_doc = _split_target_revisions(
+            docs, same_revision
+        )
+
+        initial_insert = docs
+        if existing_ok:
+            current_revs = await self._get_current_revs(
+                db, [doc["_id"] for doc in docs]
+            )
+            initial_insert = _plan_catch_up(
+                docs, current_revs, mapping_target_revnum, mapping_docid_to_doc
+            )
+
+        if initial_insert:
+            logger.debug("bulk inserting with no revision: %s", initial_insert)
+            with span("insert_initial"):
+                doc_infos = await self._post_bulk_docs(db, {"docs": initial_insert})
+            if _record_inserted_revisions(
+                doc_infos, mapping_target_revnum, mapping_docid_to_doc, same_revision
+            ):
+                sys.exit("Error inserting docs")
+
+        if not same_revision:
+            return
+
+        # 1 bulk update for each revision
+        while len(mapping_target_revnum) > 0:
+            # the list is the request body anyway, the log only formats it lazily
+            update_docs = list(mapping_docid_to_doc.values())
+            logger.debug("bulk updating: %s", update_docs)
+            with span("insert_revision"):
+                doc_infos = await self._post_bulk_docs(db, {"docs": update_docs})
+            if _record_updated_revisions(
+                doc_infos, mapping_target_revnum, mapping_docid_to_doc
+            ):
+                sys.exit("Error updating docs")
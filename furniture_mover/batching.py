@@ -0,0 +1,74 @@
+import logging
+import threading
+
+logger = logging.getLogger("batching")
+
+MIN_BATCH_BYTES = 64 * 1024
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+INITIAL_BATCH_BYTES = 1024 * 1024
+DEFAULT_LATENCY_GOAL = 1.0
+
+# weight of the latest response, the older ones fade out with 1 - SMOOTHING
+SMOOTHING = 0.3
+# the budget moves at most by these factors per response, so one slow or fast
+# outlier doesn't throw it off
+MAX_SHRINK = 0.5
+MAX_GROWTH = 2.0
+
+
+class AdaptiveBatchSizer:
+    def __init__(
+        self,
+        max_batch_bytes: int = MAX_BATCH_BYTES,
+        latency_goal: float = DEFAULT_LATENCY_GOAL,
+        min_batch_bytes: int = MIN_BATCH_BYTES,
+    ) -> None:
+        if latency_goal <= 0:
+            raise ValueError(f"Latency goal {latency_goal} is not allowed.")
+
+        self.max_batch_bytes = max_batch_bytes
+        self.min_batch_bytes = min(min_batch_bytes, max_batch_bytes)
+        self.latency_goal = latency_goal
+        self._batch_bytes = float(
+            max(self.min_batch_bytes, min(INITIAL_BATCH_BYTES, max_batch_bytes))
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def batch_bytes(self) -> int:
+        return int(self._batch_bytes)
+
+    def record(self, payload_bytes: int, seconds: float) -> None:
+        # the bytes this response suggests for the latency goal, assuming the
+        # latency grows linearly with the size of the request
+        if payload_bytes <= 0 or seconds <= 0:
+            return
+
+        with self._lock:
+            target = payload_bytes * self.latency_goal / seconds
+            target = max(
+                self._batch_bytes * MAX_SHRINK,
+                min(target, self._batch_bytes * MAX_GROWTH),
+            )
+            self._batch_bytes = self._clamp(
+                (1 - SMOOTHING) * self._batch_bytes + SMOOTHING * target
+            )
+        logger.debug(
+            f"{payload_bytes} bytes took {seconds:.3f}s, "
+            f"batch budget is now {self.batch_bytes} bytes"
+        )
+
+    def too_large(self, payload_bytes: int) -> None:
+        # the server has a hard limit below this request, never go above it again
+        with self._lock:
+            self.max_batch_bytes = max(
+                self.min_batch_bytes, min(self.max_batch_bytes, payload_bytes // 2)
+            )
+            self._batch_bytes = self._clamp(self._batch_bytes)
+        logger.info(
+            f"request of {payload_bytes} bytes was too large, "
+            f"batch budget is now at most {self.max_batch_bytes} bytes"
+        )
+
+    def _clamp(self, batch_bytes: float) -> float:
+        return max(self.min_batch_bytes, min(batch_bytes, self.max_batch_bytes))
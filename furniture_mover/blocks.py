@@ -0,0 +1,202 @@
+import io
+import json
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Deque, Iterator, List, Optional, Tuple, Union
+
+from furniture_mover.doc_ids import get_doc_id
+
+# layout of a block file:
+#   magic
+#   blocks:  whole lines, each block compressed on its own with zlib
+#   footer:  json with offset, compressed length, uncompressed size, number of
+#            docs and the smallest and largest id of every block
+#   trailer: offset of the footer, magic
+BLOCK_MAGIC = b"FMBLK001"
+BLOCK_SIZE = 1024 * 1024
+DEFAULT_LEVEL = 6
+_TRAILER = struct.Struct("<Q8s")
+
+
+class BlockWriter(io.RawIOBase):
+    def __init__(
+        self,
+        filepath: Union[str, Path],
+        level: Optional[int] = None,
+        block_size: int = BLOCK_SIZE,
+    ) -> None:
+        self._file = open(filepath, mode="wb")
+        self._file.write(BLOCK_MAGIC)
+        self._level = DEFAULT_LEVEL if level is None else level
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._blocks: List[dict] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self._block_size:
+            # blocks end at a line break, so no doc is split between two blocks
+            end = self._buffer.rfind(b"\n") + 1
+            if end:
+                self._write_block(bytes(self._buffer[:end]))
+                del self._buffer[:end]
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        try:
+            if self._buffer:
+                self._write_block(bytes(self._buffer))
+                self._buffer.clear()
+            footer_offset = self._file.tell()
+            self._file.write(json.dumps({"blocks": self._blocks}).encode("utf-8"))
+            self._file.write(_TRAILER.pack(footer_offset, BLOCK_MAGIC))
+        finally:
+            self._file.close()
+            super().close()
+
+    def _write_block(self, data: bytes) -> None:
+        doc_ids = [get_doc_id(line) for line in data.split(b"\n") if line.strip()]
+        compressed = zlib.compress(data, self._level)
+        self._blocks.append(
+            {
+                "offset": self._file.tell(),
+                "length": len(compressed),
+                "size": len(data),
+                "count": len(doc_ids),
+                "min_id": min(doc_ids) if doc_ids else None,
+                "max_id": max(doc_ids) if doc_ids else None,
+            }
+        )
+        self._file.write(compressed)
+
+
+class BlockReader(io.RawIOBase):
+    def __init__(self, filepath: Union[str, Path], workers: int = 1) -> None:
+        self._chunks = iter_blocks(filepath, read_footer(filepath), workers)
+        self._chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def read_footer(filepath: Union[str, Path]) -> List[dict]:
+    with open(filepath, mode="rb") as inf:
+        if inf.read(len(BLOCK_MAGIC)) != BLOCK_MAGIC:
+            raise ValueError(f"{filepath} is not a block file")
+
+        file_size = os.fstat(inf.fileno()).st_size
+        inf.seek(file_size - _TRAILER.size)
+        footer_offset, magic = _TRAILER.unpack(inf.read(_TRAILER.size))
+        if magic != BLOCK_MAGIC:
+            raise ValueError(f"{filepath} is incomplete, its block index is missing")
+
+        inf.seek(footer_offset)
+        footer = inf.read(file_size - _TRAILER.size - footer_offset)
+    return json.loads(footer)["blocks"]
+
+
+def iter_blocks(
+    filepath: Union[str, Path], blocks: List[dict], workers: int = 1
+) -> Iterator[bytes]:
+    def read_block(block: dict) -> bytes:
+        with open(filepath, mode="rb") as inf:
+            inf.seek(block["offset"])
+            return zlib.decompress(inf.read(block["length"]))
+
+    if workers == 1:
+        for block in blocks:
+            yield read_block(block)
+        return
+
+    # zlib releases the GIL, so blocks are decompressed in threads ahead of the
+    # reader. At most 2 * workers blocks are held in memory.
+    pending: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for block in blocks:
+            pending.append(executor.submit(read_block, block))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_block_lines(
+    filepath: Union[str, Path], offset: int = 0, workers: int = 1
+) -> Iterator[bytes]:
+    # offset is a position in the uncompressed data, blocks before it are skipped
+    position = 0
+    skip = 0
+    blocks: List[dict] = []
+    for block in read_footer(filepath):
+        if position + block["size"] > offset:
+            if not blocks:
+                skip = offset - position
+            blocks.append(block)
+        position += block["size"]
+
+    for data in iter_blocks(filepath, blocks, workers):
+        yield from io.BytesIO(data[skip:])
+        skip = 0
+
+
+def iter_block_lines_by_id(
+    filepath: Union[str, Path],
+    start_id: Optional[str] = None,
+    end_id: Optional[str] = None,
+    workers: int = 1,
+) -> Iterator[bytes]:
+    # only blocks which can contain ids of the range get decompressed. Both ids
+    # are inclusive and compared like the ids in the index, by code points.
+    blocks = [
+        block
+        for block in read_footer(filepath)
+        if block["count"]
+        and (start_id is None or block["max_id"] >= start_id)
+        and (end_id is None or block["min_id"] <= end_id)
+    ]
+    for data in iter_blocks(filepath, blocks, workers):
+        for line in io.BytesIO(data):
+            if not line.strip():
+                continue
+            doc_id = get_doc_id(line)
+            if (start_id is None or doc_id >= start_id) and (
+                end_id is None or doc_id <= end_id
+            ):
+                yield line
+
+
+def split_blocks(filepath: Union[str, Path], parts: int) -> List[Tuple[int, int]]:
+    count = len(read_footer(filepath))
+    boundaries = sorted({count * part // parts for part in range(parts + 1)})
+    if len(boundaries) == 1:
+        return [(0, 0)]
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def iter_block_lines_by_position(
+    filepath: Union[str, Path], start: int, end: int
+) -> Iterator[bytes]:
+    for data in iter_blocks(filepath, read_footer(filepath)[start:end]):
+        yield from io.BytesIO(data)
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+logger = logging.getLogger("checkpoint")
+
+
+def load_checkpoint(filepath: Union[str, Path]) -> Optional[dict]:
+    if not os.path.exists(filepath):
+        return None
+
+    with open(filepath, mode="r", encoding="utf-8") as inf:
+        return json.loads(inf.read())
+
+
+def save_checkpoint(filepath: Union[str, Path], checkpoint: dict) -> None:
+    # write to a temporary file first, so a crash never leaves a broken checkpoint
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, mode="w", encoding="utf-8") as outf:
+        outf.write(json.dumps(checkpoint, ensure_ascii=False))
+        outf.flush()
+        os.fsync(outf.fileno())
+    os.replace(tmp_filepath, filepath)
+
+
+def _try_save_checkpoint(filepath: Union[str, Path], checkpoint: dict) -> bool:
+    # the checkpoint is only needed to resume, e.g. a read-only directory must not
+    # stop the export or import itself
+    try:
+        save_checkpoint(filepath, checkpoint)
+        return True
+    except OSError as e:
+        logger.warning(
+            f"could not write checkpoint {filepath}, continuing without one: {str(e)}"
+        )
+        return False
+
+
+def _remove_checkpoint(filepath: Union[str, Path]) -> None:
+    try:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+    except OSError as e:
+        logger.warning(f"could not remove checkpoint {filepath}: {str(e)}")
+
+
+class ExportCheckpoint:
+    def __init__(self, filepath: Union[str, Path], checkpoint: dict) -> None:
+        self._filepath = filepath
+        self._checkpoint = checkpoint
+        self._enabled = True
+
+    @property
+    def offset(self) -> int:
+        return self._checkpoint["offset"]
+
+    @property
+    def last_id(self) -> Optional[str]:
+        return self._checkpoint["last_id"]
+
+    def save(self, offset: int, last_id: str) -> None:
+        self._checkpoint["offset"] = offset
+        self._checkpoint["last_id"] = last_id
+        if self._enabled:
+            self._enabled = _try_save_checkpoint(self._filepath, self._checkpoint)
+
+    def remove(self) -> None:
+        _remove_checkpoint(self._filepath)
+
+
+class BatchCheckpoint:
+    def __init__(self, filepath: Union[str, Path], checkpoint: dict) -> None:
+        self._filepath = filepath
+        self._checkpoint = checkpoint
+        self._acknowledged: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._enabled = True
+
+    @property
+    def offset(self) -> int:
+        return self._checkpoint["offset"]
+
+    @property
+    def batch(self) -> int:
+        return self._checkpoint["batch"]
+
+    def acknowledge(self, batch: int, offset: int) -> None:
+        # batches can be acknowledged out of order, the checkpoint only moves past
+        # batches whose predecessors are all acknowledged as well
+        with self._lock:
+            self._acknowledged[batch] = offset
+            if self._checkpoint["batch"] not in self._acknowledged:
+                return
+
+            while self._checkpoint["batch"] in self._acknowledged:
+                self._checkpoint["offset"] = self._acknowledged.pop(
+                    self._checkpoint["batch"]
+                )
+                self._checkpoint["batch"] += 1
+            if self._enabled:
+                self._enabled = _try_save_checkpoint(self._filepath, self._checkpoint)
+
+    def remove(self) -> None:
+        _remove_checkpoint(self._filepath)
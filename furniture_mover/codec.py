@@ -0,0 +1,44 @@
+import json
+import re
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+# orjson reads integers below -2**63 or above 2**64 - 1 as floats, so every
+# number that may be out of that range is left to json, which keeps it exact
+_LONG_NUMBER = re.compile(r"-\d{19}|\d{20}")
+_LONG_NUMBER_BYTES = re.compile(rb"-\d{19}|\d{20}")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        if isinstance(data, bytes):
+            long_number = _LONG_NUMBER_BYTES.search(data) is not None
+        else:
+            long_number = _LONG_NUMBER.search(data) is not None
+        if not long_number:
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                # e.g. lone surrogates, which orjson rejects, but json accepts
+                pass
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    # compact json for request bodies
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_line(obj: Any) -> bytes:
+    # the line format of export files, kept byte for byte as json.dumps writes it
+    # with ensure_ascii=False, because orjson only writes compact separators
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
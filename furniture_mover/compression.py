@@ -0,0 +1,106 @@
+import bz2
+import gzip
+import io
+import lzma
+import shutil
+from enum import Enum
+from pathlib import Path
+from typing import IO, List, Optional, Union, cast
+
+from furniture_mover.blocks import DEFAULT_LEVEL, BlockReader, BlockWriter
+
+
+class Compression(str, Enum):
+    auto = "auto"
+    none = "none"
+    gzip = "gzip"
+    bz2 = "bz2"
+    xz = "xz"
+    block = "block"
+
+
+EXTENSIONS = {
+    ".gz": Compression.gzip,
+    ".bz2": Compression.bz2,
+    ".xz": Compression.xz,
+    ".fmb": Compression.block,
+}
+
+# gzip defaults to its slowest level, which is rarely worth it for exports
+DEFAULT_LEVELS = {
+    Compression.gzip: 6,
+    Compression.bz2: 9,
+    Compression.xz: 6,
+    Compression.block: DEFAULT_LEVEL,
+}
+
+
+def resolve_compression(
+    filepath: Union[str, Path], compression: Compression = Compression.auto
+) -> Compression:
+    if compression != Compression.auto:
+        return compression
+
+    return EXTENSIONS.get(Path(filepath).suffix.lower(), Compression.none)
+
+
+def open_file(
+    filepath: Union[str, Path],
+    mode: str,
+    compression: Compression = Compression.auto,
+    level: Optional[int] = None,
+) -> IO[bytes]:
+    if "b" not in mode:
+        mode += "b"
+
+    compression = resolve_compression(filepath, compression)
+    if compression == Compression.none:
+        return open(filepath, mode=mode)
+
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+
+    if compression == Compression.block:
+        if "r" in mode:
+            return cast(IO[bytes], io.BufferedReader(BlockReader(filepath)))
+        return cast(IO[bytes], BlockWriter(filepath, level))
+
+    if compression == Compression.gzip:
+        return cast(IO[bytes], gzip.open(filepath, mode=mode, compresslevel=level))
+
+    if compression == Compression.bz2:
+        # bz2 has no level 0, its fastest level is 1
+        return cast(
+            IO[bytes], bz2.open(filepath, mode=mode, compresslevel=max(level, 1))
+        )
+
+    # lzma refuses a preset when reading
+    if "r" in mode:
+        return cast(IO[bytes], lzma.open(filepath, mode=mode))
+    return cast(IO[bytes], lzma.open(filepath, mode=mode, preset=level))
+
+
+def part_compression(compression: Compression) -> Compression:
+    # compressed streams can be concatenated as they are. A block file has a
+    # single index at its end, so its parts are written uncompressed instead.
+    if compression == Compression.block:
+        return Compression.none
+    return compression
+
+
+def concatenate(
+    part_filepaths: List[str],
+    filepath: Union[str, Path],
+    compression: Compression,
+    level: Optional[int] = None,
+) -> None:
+    outf: IO[bytes]
+    if part_compression(compression) == compression:
+        outf = open(filepath, mode="wb")
+    else:
+        outf = open_file(filepath, "wb", compression, level)
+
+    with outf:
+        for part_filepath in part_filepaths:
+            with open(part_filepath, mode="rb") as inf:
+                shutil.copyfileobj(inf, outf)
@@ -10,6 +10,8 @@ class Config:
         proxy: Optional[str] = None,
         timeout: float = 3,
         cert_verify: bool = True,
+        pool_maxsize: int = 10,
+        http_compression: bool = False,
     ) -> None:
         if not url.endswith("/"):
             self.url = url + "/"
@@ -28,3 +30,9 @@ class Config:
         self.timeout = timeout
 
         self.cert_verify = cert_verify
+
+        if pool_maxsize < 1:
+            raise ValueError(f"Pool size {pool_maxsize} is not allowed.")
+        self.pool_maxsize = pool_maxsize
+
+        self.http_compression = http_compression
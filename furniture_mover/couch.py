@@ -1,9 +1,14 @@
+import gzip
+import hashlib
+import json
 import logging
 import sys
+import threading
+import time
 from contextlib import contextmanager
-from copy import deepcopy
-from typing import Dict, Iterator, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
+from requests import Response
 from requests.adapters import HTTPAdapter
 from requests.exceptions import (
     ConnectionError,
@@ -15,14 +20,57 @@ from requests.exceptions import (
 from requests.packages.urllib3.util.retry import Retry
 from requests_toolbelt import sessions
 
+from furniture_mover.batching import AdaptiveBatchSizer
+from furniture_mover.codec import dumps, loads
 from furniture_mover.config import Config
+from furniture_mover.profiling import span
+from furniture_mover.rows import iter_rows
+from furniture_mover.stats import STATS, endpoint_name
 
 TargetRevNum = int
 DocId = str
+Seq = Union[str, int]
+
+STREAM_CHUNK_SIZE = 64 * 1024
+HTTP_COMPRESSION_LEVEL = 6
 
 logger = logging.getLogger("couch")
 
 
+def _synthesize_rev_id(doc_id: DocId, rev_num: int) -> str:
+    return hashlib.md5(f"{doc_id}-{rev_num}".encode("utf-8")).hexdigest()
+
+
+class TransferCounter:
+    # bytes on the wire and the json they carry, so the effect of
+    # http compression is visible
+    def __init__(self) -> None:
+        self.sent_bytes = 0
+        self.sent_payload_bytes = 0
+        self.received_bytes = 0
+        self.received_payload_bytes = 0
+        self._lock = threading.Lock()
+
+    def add_sent(self, wire_bytes: int, payload_bytes: int) -> None:
+        with self._lock:
+            self.sent_bytes += wire_bytes
+            self.sent_payload_bytes += payload_bytes
+        STATS.add_bytes(sent=wire_bytes)
+
+    def add_received(self, wire_bytes: int, payload_bytes: int) -> None:
+        with self._lock:
+            self.received_bytes += wire_bytes
+            self.received_payload_bytes += payload_bytes
+        STATS.add_bytes(received=wire_bytes)
+
+    def __str__(self) -> str:
+        return (
+            f"sent {self.sent_bytes} bytes for {self.sent_payload_bytes} bytes of json, "
+            f"received {self.received_bytes} bytes for "
+            f"{self.received_payload_bytes} bytes of json"
+        )
+
+
 class TimeoutHTTPAdapter(HTTPAdapter):
     def __init__(self, *args, **kwargs):
         self._timeout = 3
@@ -41,6 +89,9 @@ class TimeoutHTTPAdapter(HTTPAdapter):
 class CouchDb:
     def __init__(self, config: Config) -> None:
         self._config = config
+        self.transfer = TransferCounter()
+        self.batch_sizer: Optional[AdaptiveBatchSizer] = None
+        self._gzip_requests = config.http_compression
 
         self._client = sessions.BaseUrlSession(base_url=self._config.url)
 
@@ -48,7 +99,7 @@ class CouchDb:
         assert_status_hook = (
             lambda response, *args, **kwargs: response.raise_for_status()
         )
-        self._client.hooks["response"] = [assert_status_hook]
+        self._client.hooks["response"] = [_observe_response, assert_status_hook]
 
         retry_strategy = Retry(
             total=3,
@@ -67,7 +118,9 @@ class CouchDb:
 
         # retry and timeout strategy
         timeout_adapter = TimeoutHTTPAdapter(
-            timeout=self._config.timeout, max_retries=retry_strategy
+            timeout=self._config.timeout,
+            max_retries=retry_strategy,
+            pool_maxsize=self._config.pool_maxsize,
         )
         self._client.mount("http://", timeout_adapter)
         self._client.mount("https://", timeout_adapter)
@@ -84,11 +137,15 @@ class CouchDb:
                 "Cache-Control": "no-cache",
             }
         )
+        if self._config.http_compression:
+            # requests decodes gzip encoded responses, also while streaming
+            self._client.headers["Accept-Encoding"] = "gzip"
 
         # ignore ssl certificate validation
         self._client.verify = self._config.cert_verify
 
     def close(self) -> None:
+        logger.info(f"transfer of {self._config.url}: {self.transfer}")
         try:
             self._client.close()
         except Exception:
@@ -146,19 +203,24 @@ class CouchDb:
             logger.exception(e)
             sys.exit(f"Got unexpected exception: {str(e)}")
 
-    def create_db(self, db: str, exists_ok_if_empty: bool = True) -> None:
+    def create_db(
+        self, db: str, exists_ok_if_empty: bool = True, exists_ok: bool = False
+    ) -> None:
         logger.debug(
-            f"creating couch-db {db} with exists_ok_if_empty={exists_ok_if_empty}"
+            f"creating couch-db {db} with exists_ok_if_empty={exists_ok_if_empty} "
+            f"and exists_ok={exists_ok}"
         )
         try:
             with self.handle_web(raise_status=[412]):
                 logger.info(f"creating couch-db {db}")
                 self._client.put(f"{db}")
         except HTTPError:
-            if exists_ok_if_empty:
+            if exists_ok:
+                return
+            elif exists_ok_if_empty:
                 with self.handle_web():
                     db_info = self._client.get(f"{db}")
-                if db_info.json()["doc_count"] == 0:
+                if loads(self._read(db_info))["doc_count"] == 0:
                     return
                 else:
                     logger.critical(f"Database {db} exists but is not empty. Aborting.")
@@ -167,64 +229,293 @@ class CouchDb:
                 logger.critical(f"Database {db} already exists. Aborting.")
                 sys.exit(f"Database {db} already exists. Aborting.")
 
-    def get_all_docs(self, db: str) -> Iterator[dict]:
-        with self.handle_web():
-            logger.info(f"getting {db}/_all_docs?include_docs=true")
-            response = self._client.get(f"{db}/_all_docs?include_docs=true")
-
-        data = response.json()
-        logger.debug(f"got data {data}")
-        if "rows" not in data:
-            logger.critical(
-                f"got unexpected response, 'rows' missing in json. Response was {data}"
-            )
-            sys.exit(
-                f"got unexpected response, 'rows' missing in json. Response was {data}"
+    def get_db_info(self, db: str) -> dict:
+        try:
+            with self.handle_web(raise_status=[404]):
+                logger.info(f"getting info of couch-db {db}")
+                response = self._client.get(f"{db}")
+        except HTTPError:
+            logger.critical(f"Database {db} does not exist. Aborting.")
+            sys.exit(f"Database {db} does not exist. Aborting.")
+        return loads(self._read(response))
+
+    def _get_all_docs_rows(
+        self, db: str, params: Dict[str, Any], stream: bool = False
+    ) -> Iterator[dict]:
+        with span("fetch_page"):
+            with self.handle_web():
+                logger.info(f"getting {db}/_all_docs with params {params}")
+                response = self._client.get(
+                    f"{db}/_all_docs", params=params, stream=stream
+                )
+            # a streamed page is parsed while its docs get written
+            if not stream:
+                data = loads(self._read(response))
+
+        if not stream:
+            logger.debug("got data %s", data)
+            if "rows" not in data:
+                logger.critical(
+                    f"got unexpected response, 'rows' missing in json. Response was {data}"
+                )
+                sys.exit(
+                    f"got unexpected response, 'rows' missing in json. Response was {data}"
+                )
+
+            yield from data["rows"]
+            return
+
+        # parse the rows while the body is still arriving
+        with response, self.handle_web():
+            try:
+                yield from iter_rows(self._iter_lines(response))
+            except ValueError as e:
+                logger.critical(f"got unexpected response, {str(e)}")
+                sys.exit(f"got unexpected response, {str(e)}")
+
+    def _iter_lines(self, response: Response) -> Iterator[bytes]:
+        payload_bytes = 0
+        try:
+            for line in response.iter_lines(chunk_size=STREAM_CHUNK_SIZE):
+                payload_bytes += len(line) + 1
+                yield line
+        finally:
+            # iter_rows stops reading after the last row
+            self.transfer.add_received(response.raw.tell(), payload_bytes)
+
+    def _read(self, response: Response) -> bytes:
+        # tell() counts the bytes read from the socket, before decoding
+        content = response.content
+        self.transfer.add_received(response.raw.tell(), len(content))
+        return content
+
+    def _post(self, path: str, data: bytes, raise_status: List[int] = []) -> bytes:
+        if self._gzip_requests:
+            compressed = gzip.compress(data, HTTP_COMPRESSION_LEVEL)
+            try:
+                with self.handle_web(raise_status=[415] + raise_status):
+                    response = self._client.post(
+                        path, data=compressed, headers={"Content-Encoding": "gzip"}
+                    )
+                    self.transfer.add_sent(len(compressed), len(data))
+                    return self._read(response)
+            except HTTPError as e:
+                if e.response is None or e.response.status_code != 415:
+                    raise e
+                logger.warning(
+                    f"{self._config.url} does not accept gzip encoded requests, "
+                    "sending them uncompressed"
+                )
+                self._gzip_requests = False
+
+        with self.handle_web(raise_status=raise_status):
+            response = self._client.post(path, data=data)
+            self.transfer.add_sent(len(data), len(data))
+            return self._read(response)
+
+    def _post_bulk_docs(self, db: str, payload: dict) -> List[dict]:
+        data = dumps(payload)
+        start = time.perf_counter()
+        try:
+            content = self._post(f"{db}/_bulk_docs", data, raise_status=[413])
+        except HTTPError:
+            # the request exceeds max_http_request_size of the server, so it is
+            # split in half until the parts fit
+            first, last = _split_bulk_docs(
+                payload, len(data), self.batch_sizer, self._config.url
             )
+            return self._post_bulk_docs(db, first) + self._post_bulk_docs(db, last)
+
+        if self.batch_sizer is not None:
+            self.batch_sizer.record(len(data), time.perf_counter() - start)
+        STATS.observe_batch(len(payload["docs"]), len(data))
+        return loads(content)
+
+    def get_all_docs(
+        self,
+        db: str,
+        page_size: Optional[int] = None,
+        stream: bool = False,
+        startkey: Optional[DocId] = None,
+        endkey: Optional[DocId] = None,
+        start_after: Optional[DocId] = None,
+    ) -> Iterator[dict]:
+        params: Dict[str, Any] = {"include_docs": "true"}
+        if startkey is not None:
+            params["startkey"] = json.dumps(startkey)
+        if start_after is not None:
+            # not skip=1, the doc may have been deleted since, so only its own
+            # row is dropped
+            params["startkey"] = json.dumps(start_after)
+        if endkey is not None:
+            # endkey is exclusive, so adjacent ranges don't overlap
+            params["endkey"] = json.dumps(endkey)
+            params["inclusive_end"] = "false"
+
+        if page_size is None:
+            for row in self._get_all_docs_rows(db, params, stream=stream):
+                if row["id"] != start_after:
+                    yield row["doc"]
+            return
 
+        # paginate with limit/startkey, so only one page is held in memory. A page
+        # starts at the last id of the previous one, whose row is dropped, and
+        # has one more row for it. Not skip=1, that doc may be deleted meanwhile.
+        last_id = start_after
+        while True:
+            params["limit"] = page_size if last_id is None else page_size + 1
+            row_count = 0
+            previous_id = last_id
+            for row in self._get_all_docs_rows(db, params, stream=stream):
+                row_count += 1
+                if row["id"] != previous_id:
+                    last_id = row["id"]
+                    yield row["doc"]
+
+            if row_count < params["limit"]:
+                return
+
+            params["startkey"] = json.dumps(last_id)
+
+    def get_range_boundaries(self, db: str, parts: int) -> List[DocId]:
+        with self.handle_web():
+            response = self._client.get(f"{db}/_all_docs", params={"limit": 0})
+            total_rows = loads(self._read(response))["total_rows"]
+
+        # sample the doc id at every n-th position without fetching any docs
+        boundaries: List[DocId] = []
+        for part in range(1, parts):
+            skip = part * total_rows // parts
+            if skip == 0:
+                continue
+            rows = list(self._get_all_docs_rows(db, {"limit": 1, "skip": skip}))
+            if rows and (not boundaries or boundaries[-1] != rows[0]["id"]):
+                boundaries.append(rows[0]["id"])
+
+        logger.info(f"split {db} with {total_rows} rows at {boundaries}")
+        return boundaries
+
+    def get_changes(
+        self, db: str, since: Seq = 0, page_size: Optional[int] = None
+    ) -> Iterator[Tuple[Seq, dict]]:
+        params: Dict[str, Any] = {
+            "include_docs": "true",
+            "style": "all_docs",
+            "since": since,
+        }
+        if page_size is not None:
+            params["limit"] = page_size
+
+        while True:
+            with self.handle_web():
+                logger.info(f"getting {db}/_changes with params {params}")
+                response = self._client.get(f"{db}/_changes", params=params)
+
+            data = loads(self._read(response))
+            logger.debug("got data %s", data)
+            if "results" not in data:
+                logger.critical(
+                    f"got unexpected response, 'results' missing in json. Response was {data}"  # noqa
+                )
+                sys.exit(
+                    f"got unexpected response, 'results' missing in json. Response was {data}"  # noqa
+                )
+
+            for change in data["results"]:
+                doc = change.get("doc")
+                if doc is None:
+                    # deletions without a doc body still have to end up in the delta
+                    doc = {"_id": change["id"], "_rev": change["changes"][0]["rev"]}
+                    if change.get("deleted"):
+                        doc["_deleted"] = True
+                yield change["seq"], doc
+
+            if (
+                page_size is None
+                or len(data["results"]) < page_size
+                or data.get("pending") == 0
+            ):
+                return
+
+            params["since"] = data["last_seq"]
+            del data
+
+    def _get_current_revs(self, db: str, doc_ids: List[DocId]) -> Dict[DocId, str]:
+        data = loads(self._post(f"{db}/_all_docs", dumps({"keys": doc_ids})))
+
+        current_revs: Dict[DocId, str] = {}
         for row in data["rows"]:
-            yield row["doc"]
+            # missing docs only have an "error", deleted docs are marked as deleted
+            if "value" in row and not row["value"].get("deleted"):
+                current_revs[row["id"]] = row["value"]["rev"]
+        return current_revs
+
+    def apply_bulk_docs(self, db: str, docs: List[dict]) -> None:
+        logger.debug("applying bulk docs: %s", docs)
+
+        # look up the current revisions, so the docs can be written on top of them
+        current_revs = self._get_current_revs(db, [doc["_id"] for doc in docs])
+        updates = _plan_delta(docs, current_revs)
+        if not updates:
+            return
+
+        doc_infos = self._post_bulk_docs(db, {"docs": updates})
+        if _has_errors(doc_infos, "Error applying doc"):
+            sys.exit("Error applying docs")
+
+    def replay_bulk_docs(self, db: str, docs: List[dict]) -> None:
+        logger.debug("replaying bulk docs with new_edits=false: %s", docs)
+        _add_revision_histories(docs)
+
+        doc_infos = self._post_bulk_docs(db, {"docs": docs, "new_edits": False})
+        if _has_errors(doc_infos, "Error replaying doc"):
+            sys.exit("Error replaying docs")
 
     def insert_bulk_docs(
-        self, db: str, docs: List[dict], same_revision: bool = True
+        self,
+        db: str,
+        docs: List[dict],
+        same_revision: bool = True,
+        replay_revisions: bool = False,
+        existing_ok: bool = False,
     ) -> None:
-        logger.debug(f"inserting bulk docs with same_revision={same_revision}")
+        logger.debug(
+            f"inserting bulk docs with same_revision={same_revision}, "
+            f"replay_revisions={replay_revisions} and existing_ok={existing_ok}"
+        )
 
-        def _get_rev_num(rev) -> TargetRevNum:
-            return TargetRevNum(rev.split("-")[0])
+        if same_revision and replay_revisions:
+            replay_docs = [doc for doc in docs if "_rev" in doc]
+            if replay_docs:
+                self.replay_bulk_docs(db, replay_docs)
 
-        initial_insert: List[dict] = deepcopy(docs)
-        for doc in initial_insert:
-            del doc["_rev"]
+            # docs without a revision can only be inserted the usual way
+            docs = [doc for doc in docs if "_rev" not in doc]
+            if not docs:
+                return
 
-        mapping_target_revnum: Dict[DocId, TargetRevNum] = {}
-        mapping_docid_to_doc: Dict[DocId, dict] = {}
-        if same_revision:
-            for doc in docs:
-                # ignore revision 1 (only docs with rev 2 and up have to be updated again)
-                doc_revnum = _get_rev_num(doc["_rev"])
-                if doc_revnum > 1:
-                    mapping_docid_to_doc[doc["_id"]] = doc
-                    mapping_target_revnum[doc["_id"]] = doc_revnum
+        mapping_target_revnum, mapping_docid_to_doc = _split_target_revisions(
+            docs, same_revision
+        )
 
-        # initial insert
-        with self.handle_web():
-            logger.debug(f"bulk inserting with no revision: {initial_insert}")
-            response = self._client.post(
-                f"{db}/_bulk_docs", json={"docs": initial_insert}
+        initial_insert = docs
+        if existing_ok:
+            current_revs = self._get_current_revs(db, [doc["_id"] for doc in docs])
+            initial_insert = _plan_catch_up(
+                docs, current_revs, mapping_target_revnum, mapping_docid_to_doc
             )
-            del initial_insert
-
-            has_errors = False
-            for doc_info in response.json():
-                if "error" in doc_info:
-                    logger.error(f"Error inserting docs: {doc_info}")
-                    has_errors = True
-                elif not has_errors and same_revision:
-                    if mapping_target_revnum.get(doc_info["id"], None):
-                        mapping_docid_to_doc[doc_info["id"]]["_rev"] = doc_info["rev"]
-
-            if has_errors:
+
+        # initial insert
+        if initial_insert:
+            logger.debug("bulk inserting with no revision: %s", initial_insert)
+            with span("insert_initial"):
+                doc_infos = self._post_bulk_docs(db, {"docs": initial_insert})
+            if _record_inserted_revisions(
+                doc_infos,
+                mapping_target_revnum,
+                mapping_docid_to_doc,
+                same_revision,
+            ):
                 sys.exit("Error inserting docs")
 
         # if only revision 1 is needed, then we are finished here.
@@ -233,29 +524,167 @@ class CouchDb:
 
         # 1 bulk update for each revision
         while len(mapping_target_revnum) > 0:
-            with self.handle_web():
-                logger.debug(f"bulk updating: {list(mapping_docid_to_doc.values())}")
-                response = self._client.post(
-                    f"{db}/_bulk_docs",
-                    json={"docs": list(mapping_docid_to_doc.values())},
-                )
-
-                has_errors = False
-                for doc_info in response.json():
-                    if "error" in doc_info:
-                        logger.error(f"Error updating doc: {doc_info}")
-                        has_errors = True
-                        continue
-
-                    if (
-                        _get_rev_num(doc_info["rev"])
-                        == mapping_target_revnum[doc_info["id"]]
-                    ):
-                        # doc now has target_revision, can be ignored for next bulk update
-                        del mapping_target_revnum[doc_info["id"]]
-                        del mapping_docid_to_doc[doc_info["id"]]
-                    else:
-                        mapping_docid_to_doc[doc_info["id"]]["_rev"] = doc_info["rev"]
-
-                if has_errors:
-                    sys.exit("Error updating docs")
+            # the list is the request body anyway, the log only formats it lazily
+            update_docs = list(mapping_docid_to_doc.values())
+            logger.debug("bulk updating: %s", update_docs)
+            with span("insert_revision"):
+                doc_infos = self._post_bulk_docs(db, {"docs": update_docs})
+            if _record_updated_revisions(
+                doc_infos, mapping_target_revnum, mapping_docid_to_doc
+            ):
+                sys.exit("Error updating docs")
+
+
+# the bookkeeping of the bulk operations is shared with the async client, the
+# clients only differ in how they send the requests
+
+
+def _observe_response(response: Response, *args, **kwargs) -> None:
+    # elapsed is the time until the headers arrived, retries are done by urllib3
+    retries = getattr(response.raw, "retries", None)
+    STATS.observe_request(
+        endpoint_name(response.request.method or "", response.url),
+        response.elapsed.total_seconds(),
+        error=response.status_code >= 400,
+        retries=len(retries.history) if retries is not None else 0,
+    )
+
+
+def _split_bulk_docs(
+    payload: dict,
+    payload_bytes: int,
+    batch_sizer: Optional[AdaptiveBatchSizer],
+    url: str,
+) -> Tuple[dict, dict]:
+    docs = payload["docs"]
+    if len(docs) == 1:
+        logger.critical(f"Document {docs[0].get('_id')} is too large for {url}.")
+        sys.exit(f"Document {docs[0].get('_id')} is too large for {url}.")
+
+    if batch_sizer is not None:
+        batch_sizer.too_large(payload_bytes)
+    logger.info(f"splitting {len(docs)} docs of {payload_bytes} bytes for {url}")
+    middle = len(docs) // 2
+    first_docs = docs[:middle]
+    last_docs = docs[middle:]
+    return dict(payload, docs=first_docs), dict(payload, docs=last_docs)
+
+
+def _get_rev_num(rev: str) -> TargetRevNum:
+    return TargetRevNum(rev.split("-")[0])
+
+
+def _has_errors(doc_infos: List[dict], message: str) -> bool:
+    has_errors = False
+    for doc_info in doc_infos:
+        if "error" in doc_info:
+            logger.error(f"{message}: {doc_info}")
+            has_errors = True
+    return has_errors
+
+
+def _plan_delta(docs: List[dict], current_revs: Dict[DocId, str]) -> List[dict]:
+    updates: List[dict] = []
+    for doc in docs:
+        if doc["_id"] in current_revs:
+            doc["_rev"] = current_revs[doc["_id"]]
+        elif doc.get("_deleted"):
+            # already deleted or never existed, nothing to do
+            continue
+        else:
+            doc.pop("_rev", None)
+        updates.append(doc)
+    return updates
+
+
+def _add_revision_histories(docs: List[dict]) -> None:
+    # write each doc directly at its revision. couchdb needs the full revision
+    # history for that, so the ids of all ancestors are synthesized.
+    for doc in docs:
+        rev_num, rev_id = doc["_rev"].split("-", 1)
+        doc["_revisions"] = {
+            "start": int(rev_num),
+            "ids": [rev_id]
+            + [
+                _synthesize_rev_id(doc["_id"], ancestor_num)
+                for ancestor_num in range(int(rev_num) - 1, 0, -1)
+            ],
+        }
+
+
+def _split_target_revisions(
+    docs: List[dict], same_revision: bool
+) -> Tuple[Dict[DocId, TargetRevNum], Dict[DocId, dict]]:
+    # docs are modified in place: "_rev" is stripped for the initial insert
+    # and later set to the revision couchdb returned.
+    mapping_target_revnum: Dict[DocId, TargetRevNum] = {}
+    mapping_docid_to_doc: Dict[DocId, dict] = {}
+    for doc in docs:
+        rev = doc.pop("_rev", None)
+        if same_revision and rev is not None:
+            # ignore revision 1 (only docs with rev 2 and up have to be updated again)
+            doc_revnum = _get_rev_num(rev)
+            if doc_revnum > 1:
+                mapping_docid_to_doc[doc["_id"]] = doc
+                mapping_target_revnum[doc["_id"]] = doc_revnum
+    return mapping_target_revnum, mapping_docid_to_doc
+
+
+def _plan_catch_up(
+    docs: List[dict],
+    current_revs: Dict[DocId, str],
+    mapping_target_revnum: Dict[DocId, TargetRevNum],
+    mapping_docid_to_doc: Dict[DocId, dict],
+) -> List[dict]:
+    # docs written by an interrupted run continue from their current revision
+    initial_insert = []
+    for doc in docs:
+        current_rev = current_revs.get(doc["_id"])
+        target_revnum = mapping_target_revnum.get(doc["_id"], 1)
+        if current_rev is None:
+            initial_insert.append(doc)
+        elif _get_rev_num(current_rev) < target_revnum:
+            doc["_rev"] = current_rev
+        else:
+            mapping_target_revnum.pop(doc["_id"], None)
+            mapping_docid_to_doc.pop(doc["_id"], None)
+    return initial_insert
+
+
+def _record_inserted_revisions(
+    doc_infos: List[dict],
+    mapping_target_revnum: Dict[DocId, TargetRevNum],
+    mapping_docid_to_doc: Dict[DocId, dict],
+    same_revision: bool,
+) -> bool:
+    has_errors = False
+    for doc_info in doc_infos:
+        if "error" in doc_info:
+            logger.error(f"Error inserting docs: {doc_info}")
+            has_errors = True
+        elif not has_errors and same_revision:
+            doc_id = doc_info["id"]
+            if mapping_target_revnum.get(doc_id, None):
+                mapping_docid_to_doc[doc_id]["_rev"] = doc_info["rev"]
+    return has_errors
+
+
+def _record_updated_revisions(
+    doc_infos: List[dict],
+    mapping_target_revnum: Dict[DocId, TargetRevNum],
+    mapping_docid_to_doc: Dict[DocId, dict],
+) -> bool:
+    has_errors = False
+    for doc_info in doc_infos:
+        if "error" in doc_info:
+            logger.error(f"Error updating doc: {doc_info}")
+            has_errors = True
+            continue
+
+        if _get_rev_num(doc_info["rev"]) == mapping_target_revnum[doc_info["id"]]:
+            # doc now has target_revision, can be ignored for next bulk update
+            del mapping_target_revnum[doc_info["id"]]
+            del mapping_docid_to_doc[doc_info["id"]]
+        else:
+            mapping_docid_to_doc[doc_info["id"]]["_rev"] = doc_info["rev"]
+    return has_errors
@@ -0,0 +1,19 @@
+from furniture_mover.codec import loads
+
+# prefixes of lines written by json.dumps with its default and compact separators
+_ID_PREFIXES = (b'{"_id": "', b'{"_id":"')
+
+
+def get_doc_id(line: bytes) -> str:
+    # reads the _id from the start of the line without decoding the whole doc.
+    # Ids with escape sequences or docs with another layout are fully parsed.
+    for prefix in _ID_PREFIXES:
+        if line.startswith(prefix):
+            start = len(prefix)
+            end = line.find(b'"', start)
+            if end != -1:
+                doc_id = line[start:end]
+                if b"\\" not in doc_id:
+                    return doc_id.decode("utf-8")
+            break
+    return loads(line)["_id"]
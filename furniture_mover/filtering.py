@@ -0,0 +1,153 @@
+import os
+import re
+from contextlib import ExitStack
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
+
+from furniture_mover.blocks import iter_block_lines_by_position
+from furniture_mover.compression import Compression, open_file
+from furniture_mover.doc_ids import get_doc_id
+
+Output = Tuple[str, Compression]
+
+
+class LineFilter:
+    def __init__(self, filters: List[dict]) -> None:
+        # entries writing to the same file share one output, so a doc is
+        # written to it once even if it matches several of those entries
+        self.filepaths: List[str] = []
+        output_indices: Dict[str, int] = {}
+        self._targets: List[Tuple[List[Pattern], int]] = []
+        for filter_ in filters:
+            filepath = str(filter_["filepath"])
+            if filepath not in output_indices:
+                output_indices[filepath] = len(self.filepaths)
+                self.filepaths.append(filepath)
+            self._targets.append(
+                (
+                    _compile_patterns(filter_["regex_filters"]),
+                    output_indices[filepath],
+                )
+            )
+
+    def match(self, doc_id: str) -> List[int]:
+        outputs: List[int] = []
+        for patterns, output in self._targets:
+            if output in outputs:
+                continue
+            for pattern in patterns:
+                if pattern.match(doc_id):
+                    outputs.append(output)
+                    break
+        return outputs
+
+
+def _compile_patterns(regex_filters: List[str]) -> List[Pattern]:
+    # a single alternation lets the regex engine try all patterns of an entry
+    # at once. Patterns that can't be combined (e.g. global inline flags or
+    # backreferences) are kept separately.
+    if not regex_filters:
+        return []
+
+    try:
+        combined = re.compile("|".join(f"(?:{regex})" for regex in regex_filters))
+        if all(re.compile(regex).groups == 0 for regex in regex_filters):
+            return [combined]
+    except re.error:
+        pass
+    return [re.compile(regex) for regex in regex_filters]
+
+
+def filter_lines(
+    line_filter: LineFilter,
+    lines: Iterable[bytes],
+    outfiles: List[IO[bytes]],
+    unmatched_outfile: Optional[IO[bytes]] = None,
+) -> Tuple[int, int]:
+    docs_count = 0
+    unmatched_count = 0
+    for line in lines:
+        if not line.strip():
+            continue
+
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        docs_count += 1
+        outputs = line_filter.match(get_doc_id(line))
+        if not outputs:
+            unmatched_count += 1
+            if unmatched_outfile is not None:
+                unmatched_outfile.write(line)
+            continue
+
+        for output in outputs:
+            outfiles[output].write(line)
+    return docs_count, unmatched_count
+
+
+def filter_range(
+    filters: List[dict],
+    infile: Union[str, Path],
+    infile_compression: Compression,
+    start: int,
+    end: Optional[int],
+    outputs: List[Output],
+    unmatched_output: Optional[Output] = None,
+    compression_level: Optional[int] = None,
+) -> Tuple[int, int]:
+    # runs in worker processes, so it only takes picklable arguments
+    line_filter = LineFilter(filters)
+    with ExitStack() as stack:
+        outfiles = [
+            stack.enter_context(
+                open_file(filepath, "wb", compression, compression_level)
+            )
+            for filepath, compression in outputs
+        ]
+        unmatched_outfile = None
+        if unmatched_output is not None:
+            filepath, compression = unmatched_output
+            unmatched_outfile = stack.enter_context(
+                open_file(filepath, "wb", compression, compression_level)
+            )
+
+        if end is None:
+            docs_file = stack.enter_context(open_file(infile, "rb", infile_compression))
+            return filter_lines(line_filter, docs_file, outfiles, unmatched_outfile)
+
+        if infile_compression == Compression.block:
+            lines = iter_block_lines_by_position(infile, start, end)
+        else:
+            lines = _iter_range_lines(infile, start, end)
+        return filter_lines(line_filter, lines, outfiles, unmatched_outfile)
+
+
+def split_lines(filepath: Union[str, Path], parts: int) -> List[Tuple[int, int]]:
+    # byte ranges of roughly equal size, each starting at the beginning of a line
+    size = os.path.getsize(filepath)
+    boundaries = [0]
+    with open(filepath, mode="rb") as inf:
+        for part in range(1, parts):
+            position = size * part // parts
+            if position <= boundaries[-1]:
+                continue
+
+            inf.seek(position - 1)
+            inf.readline()
+            if boundaries[-1] < inf.tell() < size:
+                boundaries.append(inf.tell())
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _iter_range_lines(
+    filepath: Union[str, Path], start: int, end: int
+) -> Iterator[bytes]:
+    with open(filepath, mode="rb") as inf:
+        inf.seek(start)
+        position = start
+        for line in inf:
+            if position >= end:
+                return
+            position += len(line)
+            yield line
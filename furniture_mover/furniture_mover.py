@@ -1,67 +1,872 @@
+import asyncio
 import json
 import logging
-import re
+import os
 import sys
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from pathlib import Path
-from typing import List, Union
+from queue import Full, Queue
+from typing import IO, AsyncIterator, Iterator, List, Optional, Set, Tuple, Union
 
-from furniture_mover.couch import CouchDb
+from furniture_mover.async_couch import AsyncCouchDb, Engine
+from furniture_mover.batching import (
+    DEFAULT_LATENCY_GOAL,
+    MAX_BATCH_BYTES,
+    AdaptiveBatchSizer,
+)
+from furniture_mover.blocks import (
+    iter_block_lines,
+    iter_block_lines_by_id,
+    split_blocks,
+)
+from furniture_mover.checkpoint import (
+    BatchCheckpoint,
+    ExportCheckpoint,
+    load_checkpoint,
+    save_checkpoint,
+)
+from furniture_mover.codec import dumps_line, loads
+from furniture_mover.compression import (
+    Compression,
+    concatenate,
+    open_file,
+    part_compression,
+    resolve_compression,
+)
+from furniture_mover.config import Config
+from furniture_mover.couch import STREAM_CHUNK_SIZE, CouchDb, DocId, Seq
+from furniture_mover.filtering import LineFilter, Output, filter_range, split_lines
+from furniture_mover.index import DocIndex, IndexWriter, index_path, write_index
+from furniture_mover.profiling import span
+from furniture_mover.rows import iter_rows
+from furniture_mover.stats import STATS
 
 logger = logging.getLogger("furniture_mover")
 
+EXPORT_CHECKPOINT_INTERVAL = 1000
+
 
 class FurnitureMover:
     def __init__(self, config):
+        self._config = config
         self._couch: CouchDb = CouchDb(config)
 
     def close(self) -> None:
         self._couch.close()
 
-    def save_all_docs(self, filepath: Union[str, Path], db: str) -> None:
+    def save_all_docs(
+        self,
+        filepath: Union[str, Path],
+        db: str,
+        page_size: Optional[int] = None,
+        stream: bool = False,
+        workers: int = 1,
+        resume: bool = False,
+        checkpoint_file: Optional[Union[str, Path]] = None,
+        compression: Compression = Compression.auto,
+        compression_level: Optional[int] = None,
+        engine: Engine = Engine.sync,
+        index: bool = False,
+    ) -> None:
+        compression = resolve_compression(filepath, compression)
+        if engine == Engine.asyncio:
+            if stream or resume:
+                logger.critical(
+                    "--engine asyncio can not be combined with --stream or --resume."
+                )
+                sys.exit(
+                    "--engine asyncio can not be combined with --stream or --resume."
+                )
+            asyncio.run(
+                self._save_all_docs_async(
+                    filepath, db, page_size, workers, compression, compression_level
+                )
+            )
+            if index:
+                self.index_file(filepath)
+            return
+
+        if workers == 1:
+            if checkpoint_file is None:
+                checkpoint_file = f"{filepath}.checkpoint"
+
+            # offsets into a compressed stream can't be resumed from, so there is
+            # no checkpoint for compressed files
+            checkpoint: Optional[dict] = None
+            if compression == Compression.none:
+                checkpoint = {
+                    "kind": "export",
+                    "filepath": str(filepath),
+                    "db": db,
+                    "offset": 0,
+                    "last_id": None,
+                }
+            elif resume:
+                logger.critical("--resume is not supported for compressed files.")
+                sys.exit("--resume is not supported for compressed files.")
+
+            if resume and checkpoint is not None:
+                checkpoint = (
+                    self._load_resume_checkpoint(checkpoint_file, db, "export")
+                    or checkpoint
+                )
+                if checkpoint["offset"] > 0 and (
+                    not os.path.exists(filepath)
+                    or os.path.getsize(filepath) < checkpoint["offset"]
+                ):
+                    logger.critical(
+                        f"File {filepath} is shorter than its checkpoint. Aborting."
+                    )
+                    sys.exit(
+                        f"File {filepath} is shorter than its checkpoint. Aborting."
+                    )
+
+            export_checkpoint = None
+            if checkpoint is not None:
+                export_checkpoint = ExportCheckpoint(checkpoint_file, checkpoint)
+
+            # continue right after the last doc that is completely written
+            self._save_docs(
+                filepath,
+                self._couch.get_all_docs(
+                    db,
+                    page_size=page_size,
+                    stream=stream,
+                    start_after=checkpoint["last_id"] if checkpoint else None,
+                ),
+                checkpoint=export_checkpoint,
+                compression=compression,
+                compression_level=compression_level,
+                index_file=index_path(filepath) if index else None,
+            )
+            if os.path.exists(checkpoint_file):
+                os.remove(checkpoint_file)
+            return
+
+        if resume:
+            logger.critical("--resume can not be combined with --workers.")
+            sys.exit("--resume can not be combined with --workers.")
+
+        # split the keyspace into ranges, fetch them concurrently into part files
+        # and merge those in order, so the output is the same as a single export
+        ranges = self._key_ranges(self._couch.get_range_boundaries(db, workers))
+        part_paths = [f"{filepath}.part{i}" for i in range(len(ranges))]
         try:
-            with open(filepath, mode="w", encoding="utf-8") as outf:
-                for doc in self._couch.get_all_docs(db):
-                    outf.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._save_docs,
+                        part_path,
+                        self._couch.get_all_docs(
+                            db,
+                            page_size=page_size,
+                            stream=stream,
+                            startkey=startkey,
+                            endkey=endkey,
+                        ),
+                        compression=part_compression(compression),
+                        compression_level=compression_level,
+                    )
+                    for part_path, (startkey, endkey) in zip(part_paths, ranges)
+                ]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            try:
+                concatenate(part_paths, filepath, compression, compression_level)
+            except Exception as e:
+                logger.exception(e)
+                sys.exit(f"Exception opening or writing file: {str(e)}")
+        finally:
+            for part_path in part_paths:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+
+        # the offsets are only known once the parts are merged
+        if index:
+            self.index_file(filepath)
+
+    async def _save_all_docs_async(
+        self,
+        filepath: Union[str, Path],
+        db: str,
+        page_size: Optional[int],
+        workers: int,
+        compression: Compression,
+        compression_level: Optional[int],
+    ) -> None:
+        # the same ranges as the threaded export, but all of them are fetched on
+        # one thread with one request in flight per range
+        async with AsyncCouchDb(self._config) as client:
+            boundaries: List[DocId] = []
+            if workers > 1:
+                boundaries = await client.get_range_boundaries(db, workers)
+            ranges = self._key_ranges(boundaries)
+            part_paths = [f"{filepath}.part{i}" for i in range(len(ranges))]
+            try:
+                await asyncio.gather(
+                    *[
+                        self._save_docs_async(
+                            part_path,
+                            client.get_all_docs(
+                                db,
+                                page_size=page_size,
+                                startkey=startkey,
+                                endkey=endkey,
+                            ),
+                            part_compression(compression),
+                            compression_level,
+                        )
+                        for part_path, (startkey, endkey) in zip(part_paths, ranges)
+                    ]
+                )
+
+                try:
+                    concatenate(part_paths, filepath, compression, compression_level)
+                except Exception as e:
+                    logger.exception(e)
+                    sys.exit(f"Exception opening or writing file: {str(e)}")
+            finally:
+                for part_path in part_paths:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+
+    @staticmethod
+    async def _save_docs_async(
+        filepath: Union[str, Path],
+        docs: AsyncIterator[dict],
+        compression: Compression,
+        compression_level: Optional[int],
+    ) -> None:
+        try:
+            with open_file(filepath, "wb", compression, compression_level) as outf:
+                count = 0
+                write_seconds = 0.0
+                async for doc in docs:
+                    started = time.perf_counter()
+                    outf.write(dumps_line(doc))
+                    write_seconds += time.perf_counter() - started
+                    count += 1
+                    if count % EXPORT_CHECKPOINT_INTERVAL == 0:
+                        STATS.add_docs(EXPORT_CHECKPOINT_INTERVAL)
+                        STATS.observe_span("write_docs", write_seconds)
+                        write_seconds = 0.0
+                STATS.add_docs(count % EXPORT_CHECKPOINT_INTERVAL)
+                if count % EXPORT_CHECKPOINT_INTERVAL:
+                    STATS.observe_span("write_docs", write_seconds)
         except Exception as e:
             logger.exception(e)
             sys.exit(f"Exception opening or writing file: {str(e)}")
 
+    def save_changes(
+        self,
+        filepath: Union[str, Path],
+        db: str,
+        since: Optional[Seq] = None,
+        since_checkpoint: Optional[Union[str, Path]] = None,
+        checkpoint_file: Optional[Union[str, Path]] = None,
+        page_size: Optional[int] = None,
+        compression: Compression = Compression.auto,
+        compression_level: Optional[int] = None,
+        index: bool = False,
+    ) -> None:
+        # the delta starts at a sequence or at the one stored by a previous run
+        since_seq: Seq = since if since is not None else 0
+        if since_checkpoint is not None:
+            try:
+                checkpoint = load_checkpoint(since_checkpoint)
+            except Exception as e:
+                logger.exception(e)
+                sys.exit(
+                    f"Exception opening or reading file {since_checkpoint}: {str(e)}"
+                )
+            if checkpoint is None:
+                logger.critical(
+                    f"Checkpoint {since_checkpoint} does not exist. Aborting."
+                )
+                sys.exit(f"Checkpoint {since_checkpoint} does not exist. Aborting.")
+            if checkpoint.get("db") != db:
+                logger.critical(
+                    f"Checkpoint {since_checkpoint} does not belong to {db}. Aborting."
+                )
+                sys.exit(
+                    f"Checkpoint {since_checkpoint} does not belong to {db}. Aborting."
+                )
+            since_seq = checkpoint["last_seq"]
+            if checkpoint_file is None:
+                checkpoint_file = since_checkpoint
+
+        if checkpoint_file is None:
+            checkpoint_file = f"{filepath}.seq"
+
+        last_seq = since_seq
+
+        def iter_docs() -> Iterator[dict]:
+            nonlocal last_seq
+            for seq, doc in self._couch.get_changes(db, since_seq, page_size=page_size):
+                last_seq = seq
+                yield doc
+
+        logger.info(f"exporting changes of {db} since {since_seq}")
+        self._save_docs(
+            filepath,
+            iter_docs(),
+            compression=compression,
+            compression_level=compression_level,
+            index_file=index_path(filepath) if index else None,
+        )
+
+        # only store the new sequence once the delta is completely written
+        try:
+            save_checkpoint(checkpoint_file, {"db": db, "last_seq": last_seq})
+        except Exception as e:
+            logger.exception(e)
+            sys.exit(f"Exception opening or writing file: {str(e)}")
+        logger.info(f"saved last_seq {last_seq} to {checkpoint_file}")
+
+    @staticmethod
+    def _save_docs(
+        filepath: Union[str, Path],
+        docs: Iterator[dict],
+        checkpoint: Optional[ExportCheckpoint] = None,
+        compression: Compression = Compression.auto,
+        compression_level: Optional[int] = None,
+        index_file: Optional[Union[str, Path]] = None,
+    ) -> None:
+        offset = checkpoint.offset if checkpoint is not None else 0
+        # the index is built from the lines as they are written, a resumed export
+        # doesn't know the lines before its checkpoint and indexes the whole file
+        index_writer = None
+        if index_file is not None and not offset:
+            index_writer = IndexWriter(index_file)
+        line_offset = 0
+        try:
+            outf: IO[bytes]
+            if offset:
+                outf = open(filepath, mode="r+b")
+                # drops a partially written line of an interrupted export
+                outf.truncate(offset)
+                outf.seek(offset)
+            else:
+                outf = open_file(filepath, "wb", compression, compression_level)
+
+            with outf:
+                count = 0
+                # fetching the docs happens in between, so only the writes are timed
+                write_seconds = 0.0
+                for count, doc in enumerate(docs, start=1):
+                    started = time.perf_counter()
+                    line = dumps_line(doc)
+                    outf.write(line)
+                    write_seconds += time.perf_counter() - started
+                    if index_writer is not None:
+                        index_writer.add(doc["_id"], line_offset, len(line))
+                        line_offset += len(line)
+
+                    # the stats get the docs in steps, not for every doc
+                    if count % EXPORT_CHECKPOINT_INTERVAL == 0:
+                        STATS.add_docs(EXPORT_CHECKPOINT_INTERVAL)
+                        if checkpoint is not None:
+                            outf.flush()
+                            os.fsync(outf.fileno())
+                            checkpoint.save(outf.tell(), doc["_id"])
+                        STATS.observe_span("write_docs", write_seconds)
+                        write_seconds = 0.0
+                STATS.add_docs(count % EXPORT_CHECKPOINT_INTERVAL)
+                if count % EXPORT_CHECKPOINT_INTERVAL:
+                    STATS.observe_span("write_docs", write_seconds)
+
+            if index_writer is not None:
+                count = index_writer.finish(line_offset)
+            elif index_file is not None:
+                count = write_index(filepath, index_file)
+            if index_file is not None:
+                logger.info(f"indexed {count} docs of {filepath} into {index_file}")
+        except Exception as e:
+            logger.exception(e)
+            sys.exit(f"Exception opening or writing file: {str(e)}")
+        finally:
+            if index_writer is not None:
+                index_writer.close()
+
+    @staticmethod
+    def _key_ranges(
+        boundaries: List[DocId],
+    ) -> List[Tuple[Optional[DocId], Optional[DocId]]]:
+        # the first range is open at the start and the last one at the end
+        starts: List[Optional[DocId]] = [None, *boundaries]
+        ends: List[Optional[DocId]] = [*boundaries, None]
+        return list(zip(starts, ends))
+
+    @staticmethod
+    def _load_resume_checkpoint(
+        checkpoint_file: Union[str, Path], db: str, kind: str
+    ) -> Optional[dict]:
+        try:
+            checkpoint = load_checkpoint(checkpoint_file)
+        except Exception as e:
+            logger.exception(e)
+            sys.exit(f"Exception opening or reading file {checkpoint_file}: {str(e)}")
+
+        if checkpoint is None:
+            logger.warning(
+                f"no checkpoint {checkpoint_file} found, starting from the beginning"
+            )
+        elif checkpoint.get("kind") != kind:
+            # export and import share the default FILEPATH.checkpoint
+            logger.critical(
+                f"Checkpoint {checkpoint_file} is not an {kind} checkpoint. Aborting."
+            )
+            sys.exit(
+                f"Checkpoint {checkpoint_file} is not an {kind} checkpoint. Aborting."
+            )
+        elif checkpoint.get("db") != db:
+            logger.critical(
+                f"Checkpoint {checkpoint_file} does not belong to {db}. Aborting."
+            )
+            sys.exit(f"Checkpoint {checkpoint_file} does not belong to {db}. Aborting.")
+        else:
+            logger.info(f"resuming from checkpoint {checkpoint}")
+        return checkpoint
+
     def insert_all_docs(
         self,
         filepath: Union[str, Path],
         db: str,
         same_revision: bool = True,
         db_exists_ok_if_empty: bool = True,
+        batch_size: int = 1000,
+        batch_bytes: Optional[int] = None,
+        replay_revisions: bool = False,
+        workers: int = 1,
+        delta: bool = False,
+        resume: bool = False,
+        checkpoint_file: Optional[Union[str, Path]] = None,
+        compression: Compression = Compression.auto,
+        start_id: Optional[str] = None,
+        end_id: Optional[str] = None,
+        index_file: Optional[Union[str, Path]] = None,
+        engine: Engine = Engine.sync,
+        adaptive_batching: bool = False,
+        batch_latency: float = DEFAULT_LATENCY_GOAL,
+    ) -> None:
+        if delta and replay_revisions:
+            logger.critical("--delta can not be combined with --replay-revisions.")
+            sys.exit("--delta can not be combined with --replay-revisions.")
+
+        if checkpoint_file is None:
+            checkpoint_file = f"{filepath}.checkpoint"
+
+        # with an id range the docs are read through the index and the offset in
+        # the checkpoint counts the docs of that range instead of bytes
+        use_index = start_id is not None or end_id is not None
+        checkpoint = {
+            "kind": "import",
+            "filepath": str(filepath),
+            "db": db,
+            "offset": 0,
+            "batch": 0,
+        }
+        if use_index:
+            checkpoint.update({"start_id": start_id, "end_id": end_id})
+        if resume:
+            checkpoint = (
+                self._load_resume_checkpoint(checkpoint_file, db, "import")
+                or checkpoint
+            )
+            if (checkpoint.get("start_id"), checkpoint.get("end_id")) != (
+                start_id,
+                end_id,
+            ):
+                logger.critical(
+                    f"Checkpoint {checkpoint_file} belongs to another id range. Aborting."
+                )
+                sys.exit(
+                    f"Checkpoint {checkpoint_file} belongs to another id range. Aborting."
+                )
+        batch_checkpoint = BatchCheckpoint(checkpoint_file, checkpoint)
+
+        # a delta is applied on top of an existing database, a resumed import
+        # continues in the partly filled database
+        with span("create_db"):
+            self._couch.create_db(db, db_exists_ok_if_empty, exists_ok=delta or resume)
+
+        def insert_batch(batch_number: int, docs: List[dict], end_offset: int) -> None:
+            logger.info(f"inserting batch {batch_number} of {len(docs)} docs")
+            if delta:
+                self._couch.apply_bulk_docs(db, docs)
+            else:
+                # batches after the checkpoint may have been written partly already
+                self._couch.insert_bulk_docs(
+                    db,
+                    docs,
+                    same_revision=same_revision,
+                    replay_revisions=replay_revisions,
+                    existing_ok=resume,
+                )
+            batch_checkpoint.acknowledge(batch_number, end_offset)
+            STATS.add_docs(len(docs))
+
+        is_block_file = resolve_compression(filepath, compression) == Compression.block
+        if use_index and is_block_file:
+            # block files carry the id range of every block instead of an index
+            read_docs = self._read_block_range_docs(
+                filepath, start_id, end_id, batch_checkpoint.offset, workers
+            )
+        elif use_index:
+            read_docs = self._read_indexed_docs(
+                filepath, index_file, start_id, end_id, batch_checkpoint.offset
+            )
+        else:
+            read_docs = self._read_docs(
+                filepath, batch_checkpoint.offset, compression, workers
+            )
+        # with adaptive batching --batch-bytes is the upper bound of the byte budget,
+        # which follows the latency of the _bulk_docs requests
+        batch_sizer: Optional[AdaptiveBatchSizer] = None
+        if adaptive_batching:
+            batch_sizer = AdaptiveBatchSizer(
+                batch_bytes or MAX_BATCH_BYTES, batch_latency
+            )
+            self._couch.batch_sizer = batch_sizer
+
+        batches = enumerate(
+            self._iter_batches(
+                read_docs,
+                batch_size,
+                batch_bytes,
+                offset=batch_checkpoint.offset,
+                batch_sizer=batch_sizer,
+            ),
+            start=batch_checkpoint.batch,
+        )
+        if engine == Engine.asyncio:
+            asyncio.run(
+                self._insert_batches_async(
+                    db,
+                    batches,
+                    batch_checkpoint,
+                    workers,
+                    same_revision=same_revision,
+                    replay_revisions=replay_revisions,
+                    delta=delta,
+                    resume=resume,
+                    batch_sizer=batch_sizer,
+                )
+            )
+            batch_checkpoint.remove()
+            return
+
+        if workers == 1:
+            for batch_number, (docs, end_offset) in batches:
+                insert_batch(batch_number, docs, end_offset)
+            batch_checkpoint.remove()
+            return
+
+        # every doc is in exactly one batch, so batches (including their revision
+        # updates) are independent of each other and can be inserted concurrently.
+        # At most 2 * workers batches are in flight, so reading the file can't run
+        # away from the inserts.
+        in_flight: Set[Future] = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for batch_number, (docs, end_offset) in batches:
+                    if len(in_flight) >= 2 * workers:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    in_flight.add(
+                        executor.submit(insert_batch, batch_number, docs, end_offset)
+                    )
+
+                for future in as_completed(in_flight):
+                    future.result()
+            except BaseException:
+                for future in in_flight:
+                    future.cancel()
+                raise
+        batch_checkpoint.remove()
+
+    async def _insert_batches_async(
+        self,
+        db: str,
+        batches: Iterator[Tuple[int, Tuple[List[dict], int]]],
+        batch_checkpoint: BatchCheckpoint,
+        workers: int,
+        same_revision: bool,
+        replay_revisions: bool,
+        delta: bool,
+        resume: bool,
+        batch_sizer: Optional[AdaptiveBatchSizer] = None,
     ) -> None:
-        self._couch.create_db(db, db_exists_ok_if_empty)
-        docs: List[dict] = []
+        async with AsyncCouchDb(self._config) as client:
+            client.batch_sizer = batch_sizer
+
+            async def insert_batch(
+                batch_number: int, docs: List[dict], end_offset: int
+            ) -> None:
+                logger.info(f"inserting batch {batch_number} of {len(docs)} docs")
+                if delta:
+                    await client.apply_bulk_docs(db, docs)
+                else:
+                    await client.insert_bulk_docs(
+                        db,
+                        docs,
+                        same_revision=same_revision,
+                        replay_revisions=replay_revisions,
+                        existing_ok=resume,
+                    )
+                batch_checkpoint.acknowledge(batch_number, end_offset)
+                STATS.add_docs(len(docs))
+
+            # like the threaded import, at most 2 * workers batches are in flight,
+            # but as tasks on one thread instead of threads
+            in_flight: Set[asyncio.Future] = set()
+            try:
+                for batch_number, (docs, end_offset) in batches:
+                    if len(in_flight) >= 2 * workers:
+                        done, in_flight = await asyncio.wait(
+                            in_flight, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        for task in done:
+                            task.result()
+                    in_flight.add(
+                        asyncio.ensure_future(
+                            insert_batch(batch_number, docs, end_offset)
+                        )
+                    )
+
+                if in_flight:
+                    await asyncio.gather(*in_flight)
+            except BaseException:
+                for task in in_flight:
+                    task.cancel()
+                raise
+
+    @staticmethod
+    def _read_docs(
+        filepath: Union[str, Path],
+        offset: int = 0,
+        compression: Compression = Compression.auto,
+        workers: int = 1,
+    ) -> Iterator[Tuple[dict, int, int]]:
         try:
-            with open(filepath, mode="r", encoding="utf-8") as inf:
-                for line in inf:
-                    docs.append(json.loads(line))
+            for line in FurnitureMover._iter_lines(
+                filepath, offset, compression, workers
+            ):
+                offset += len(line)
+                if line.strip():
+                    yield loads(line), len(line), offset
         except Exception as e:
             logger.exception(e)
             sys.exit(f"Exception opening or writing file: {str(e)}")
 
-        self._couch.insert_bulk_docs(db, docs, same_revision=same_revision)
+    @staticmethod
+    def _iter_lines(
+        filepath: Union[str, Path],
+        offset: int,
+        compression: Compression,
+        workers: int,
+    ) -> Iterator[bytes]:
+        # offsets are positions in the uncompressed stream
+        if resolve_compression(filepath, compression) == Compression.block:
+            # blocks are decompressed by the workers ahead of the inserts
+            yield from iter_block_lines(filepath, offset, workers)
+            return
+
+        with open_file(filepath, "rb", compression) as inf:
+            inf.seek(offset)
+            yield from inf
 
     @staticmethod
-    def from_all_docs_file(infile: Path, outfile: Path) -> None:
-        data = None
+    def _read_block_range_docs(
+        filepath: Union[str, Path],
+        start_id: Optional[str],
+        end_id: Optional[str],
+        skip: int = 0,
+        workers: int = 1,
+    ) -> Iterator[Tuple[dict, int, int]]:
         try:
-            with open(infile, mode="r", encoding="utf-8") as inf:
-                data = json.loads(inf.read())
+            lines = iter_block_lines_by_id(filepath, start_id, end_id, workers)
+            for count, line in enumerate(lines, start=1):
+                if count > skip:
+                    yield loads(line), len(line), count
         except Exception as e:
             logger.exception(e)
-            sys.exit(f"Exception opening or reading file {infile}: {str(e)}")
+            sys.exit(f"Exception opening or reading file: {str(e)}")
 
-        if data is not None and "rows" in data:
-            with open(outfile, mode="w", encoding="utf-8") as outf:
-                for row in data["rows"]:
-                    outf.write(json.dumps(row["doc"], ensure_ascii=False) + "\n")
+    @staticmethod
+    def _read_indexed_docs(
+        filepath: Union[str, Path],
+        index_file: Optional[Union[str, Path]],
+        start_id: Optional[str],
+        end_id: Optional[str],
+        skip: int = 0,
+    ) -> Iterator[Tuple[dict, int, int]]:
+        with FurnitureMover._open_index(filepath, index_file) as index:
+            positions = index.positions(start_id, end_id)
+            for count, position in enumerate(positions[skip:], start=skip + 1):
+                line = index.line(position)
+                yield loads(line), len(line), count
+
+    @staticmethod
+    def _iter_batches(
+        docs: Iterator[Tuple[dict, int, int]],
+        batch_size: int,
+        batch_bytes: Optional[int] = None,
+        offset: int = 0,
+        batch_sizer: Optional[AdaptiveBatchSizer] = None,
+    ) -> Iterator[Tuple[List[dict], int]]:
+        # the budget of a batch sizer is read for every new batch, the number of
+        # docs is not limited then
+        if batch_sizer is not None:
+            batch_bytes = batch_sizer.batch_bytes
+
+        batch: List[dict] = []
+        size = 0
+        # the time until a batch is complete is spent reading and parsing the
+        # file, inserting happens while it is yielded
+        started = time.perf_counter()
+        for doc, doc_size, end_offset in docs:
+            if batch and (
+                (batch_sizer is None and len(batch) >= batch_size)
+                or (batch_bytes is not None and size + doc_size > batch_bytes)
+            ):
+                STATS.observe_span("read_file", time.perf_counter() - started)
+                yield batch, offset
+                started = time.perf_counter()
+                batch = []
+                size = 0
+                if batch_sizer is not None:
+                    batch_bytes = batch_sizer.batch_bytes
+
+            batch.append(doc)
+            size += doc_size
+            offset = end_offset
+
+        if batch:
+            STATS.observe_span("read_file", time.perf_counter() - started)
+            yield batch, offset
+
+    def copy_docs(
+        self,
+        db: str,
+        target_config: Config,
+        target_db: str,
+        page_size: int = 1000,
+        same_revision: bool = True,
+        db_exists_ok_if_empty: bool = True,
+        replay_revisions: bool = False,
+        queue_size: int = 2,
+    ) -> None:
+        # a missing source must not leave an empty target behind
+        self._couch.get_db_info(db)
+        target = CouchDb(target_config)
+        try:
+            with span("create_db"):
+                target.create_db(target_db, db_exists_ok_if_empty)
+
+            # the next pages are fetched from the source while a page is inserted
+            # into the target. At most queue_size pages wait in memory.
+            pages: "Queue[Optional[List[dict]]]" = Queue(maxsize=queue_size)
+            stop = threading.Event()
+
+            def put(page: Optional[List[dict]]) -> bool:
+                while not stop.is_set():
+                    try:
+                        pages.put(page, timeout=0.1)
+                        return True
+                    except Full:
+                        pass
+                return False
+
+            def read_pages() -> None:
+                try:
+                    page: List[dict] = []
+                    for doc in self._couch.get_all_docs(db, page_size=page_size):
+                        page.append(doc)
+                        if len(page) == page_size:
+                            if not put(page):
+                                return
+                            page = []
+                    if page:
+                        put(page)
+                finally:
+                    put(None)
+
+            docs_count = 0
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                reader = executor.submit(read_pages)
+                try:
+                    for page_number, page in enumerate(iter(pages.get, None)):
+                        logger.info(f"copying page {page_number} of {len(page)} docs")
+                        target.insert_bulk_docs(
+                            target_db,
+                            page,
+                            same_revision=same_revision,
+                            replay_revisions=replay_revisions,
+                        )
+                        docs_count += len(page)
+                        STATS.add_docs(len(page))
+                finally:
+                    stop.set()
+                reader.result()
+            logger.info(f"copied {docs_count} docs from {db} to {target_db}")
+        finally:
+            target.close()
+
+    @staticmethod
+    def from_all_docs_file(
+        infile: Path,
+        outfile: Path,
+        compression: Compression = Compression.auto,
+        compression_level: Optional[int] = None,
+        index: bool = False,
+    ) -> None:
+        FurnitureMover._save_docs(
+            outfile,
+            FurnitureMover._read_all_docs_file(infile),
+            compression=compression,
+            compression_level=compression_level,
+            index_file=index_path(outfile) if index else None,
+        )
 
     @staticmethod
-    def filter_infile(filter_file: Path, infile: Path) -> None:
+    def _read_all_docs_file(infile: Path) -> Iterator[dict]:
+        try:
+            with open_file(infile, "rb") as inf:
+                # lines are read in bounded pieces, so a dump without line breaks
+                # goes through the incremental parser instead of into memory
+                lines = iter(lambda: inf.readline(STREAM_CHUNK_SIZE), b"")
+                for row in iter_rows(lines):
+                    yield row["doc"]
+        except Exception as e:
+            logger.exception(e)
+            sys.exit(f"Exception opening or reading file {infile}: {str(e)}")
+
+    @staticmethod
+    def filter_infile(
+        filter_file: Path,
+        infile: Path,
+        compression: Compression = Compression.auto,
+        compression_level: Optional[int] = None,
+        unmatched_file: Optional[Path] = None,
+        workers: int = 1,
+    ) -> None:
         filters = None
         try:
             with open(filter_file, "r", encoding="utf-8") as inf:
@@ -70,25 +875,172 @@ class FurnitureMover:
             logger.exception(e)
             sys.exit(f"Exception opening or reading file {filter_file}: {str(e)}")
 
-        matched_docs = set()
-        all_docs = set()
-        for filter_ in filters:
-            with open(filter_["filepath"], "w", encoding="utf-8") as outf:
-                with open(infile, "r", encoding="utf-8") as inf:
-                    for line in inf:
-                        data = json.loads(line)
-                        all_docs.add(data["_id"])
-                        for regex in filter_["regex_filters"]:
-                            if re.match(regex, data["_id"]):
-                                outf.write(json.dumps(data) + "\n")
-                                matched_docs.add(data["_id"])
-                                break
-
-        not_matched_docs = set()
-        for doc_id in all_docs:
-            if doc_id not in matched_docs:
-                not_matched_docs.add(doc_id)
-        if len(not_matched_docs) > 0:
+        infile_compression = resolve_compression(infile, compression)
+        if workers > 1 and infile_compression not in (
+            Compression.none,
+            Compression.block,
+        ):
+            logger.warning("compressed files can't be split, filtering with 1 worker")
+            workers = 1
+
+        outputs = [
+            (filepath, resolve_compression(filepath, compression))
+            for filepath in LineFilter(filters).filepaths
+        ]
+        unmatched_output = None
+        if unmatched_file is not None:
+            unmatched_output = (
+                str(unmatched_file),
+                resolve_compression(unmatched_file, compression),
+            )
+
+        if workers == 1:
+            docs_count, unmatched_count = filter_range(
+                filters,
+                infile,
+                infile_compression,
+                0,
+                None,
+                outputs,
+                unmatched_output,
+                compression_level,
+            )
+        else:
+            docs_count, unmatched_count = FurnitureMover._filter_parallel(
+                filters,
+                infile,
+                infile_compression,
+                workers,
+                outputs,
+                unmatched_output,
+                compression_level,
+            )
+
+        STATS.add_docs(docs_count)
+        if unmatched_count > 0:
             logger.warning(
-                f"the following docs did not get matched: {not_matched_docs}"
+                f"{unmatched_count} of {docs_count} docs did not get matched"
+                + (f", see {unmatched_file}" if unmatched_file is not None else "")
             )
+
+    @staticmethod
+    def _filter_parallel(
+        filters: List[dict],
+        infile: Path,
+        infile_compression: Compression,
+        workers: int,
+        outputs: List[Output],
+        unmatched_output: Optional[Output],
+        compression_level: Optional[int],
+    ) -> Tuple[int, int]:
+        # each process filters one range of lines (or of blocks) into its own part
+        # files, the parts of every output are concatenated in order afterwards
+        all_outputs = outputs + ([unmatched_output] if unmatched_output else [])
+        if infile_compression == Compression.block:
+            ranges = split_blocks(infile, workers)
+        else:
+            ranges = split_lines(infile, workers)
+        part_outputs = [
+            [
+                (f"{filepath}.part{i}", part_compression(compression))
+                for filepath, compression in all_outputs
+            ]
+            for i in range(len(ranges))
+        ]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        filter_range,
+                        filters,
+                        str(infile),
+                        infile_compression,
+                        start,
+                        end,
+                        parts[: len(outputs)],
+                        parts[len(outputs)] if unmatched_output else None,
+                        compression_level,
+                    )
+                    for (start, end), parts in zip(ranges, part_outputs)
+                ]
+                counts = [future.result() for future in futures]
+
+            for output_index, (filepath, compression) in enumerate(all_outputs):
+                concatenate(
+                    [parts[output_index][0] for parts in part_outputs],
+                    filepath,
+                    compression,
+                    compression_level,
+                )
+        finally:
+            for parts in part_outputs:
+                for part_filepath, _ in parts:
+                    if os.path.exists(part_filepath):
+                        os.remove(part_filepath)
+
+        return sum(count[0] for count in counts), sum(count[1] for count in counts)
+
+    @staticmethod
+    def _open_index(
+        filepath: Union[str, Path], index_file: Optional[Union[str, Path]] = None
+    ) -> DocIndex:
+        if index_file is None:
+            index_file = index_path(filepath)
+        try:
+            return DocIndex(filepath, index_file)
+        except Exception as e:
+            logger.exception(e)
+            sys.exit(f"Exception opening or reading index {index_file}: {str(e)}")
+
+    @staticmethod
+    def index_file(
+        filepath: Union[str, Path],
+        index_file: Optional[Union[str, Path]] = None,
+        compression: Compression = Compression.auto,
+    ) -> None:
+        # offsets into a compressed stream can't be read through mmap
+        if resolve_compression(filepath, compression) != Compression.none:
+            logger.critical("Compressed files can not be indexed.")
+            sys.exit("Compressed files can not be indexed.")
+
+        if index_file is None:
+            index_file = index_path(filepath)
+        try:
+            count = write_index(filepath, index_file)
+        except Exception as e:
+            logger.exception(e)
+            sys.exit(f"Exception indexing file {filepath}: {str(e)}")
+        logger.info(f"indexed {count} docs of {filepath} into {index_file}")
+
+    @staticmethod
+    def lookup_docs(
+        filepath: Union[str, Path],
+        doc_ids: List[str],
+        index_file: Optional[Union[str, Path]] = None,
+    ) -> List[Optional[str]]:
+        docs: List[Optional[str]] = []
+        with FurnitureMover._open_index(filepath, index_file) as index:
+            for doc_id in doc_ids:
+                line = index.find(doc_id)
+                docs.append(line.rstrip(b"\r\n").decode("utf-8") if line else None)
+        return docs
+
+    @staticmethod
+    def extract_range(
+        filepath: Union[str, Path],
+        outfile: Union[str, Path],
+        start_id: Optional[str] = None,
+        end_id: Optional[str] = None,
+        index_file: Optional[Union[str, Path]] = None,
+        compression: Compression = Compression.auto,
+        compression_level: Optional[int] = None,
+    ) -> None:
+        with FurnitureMover._open_index(filepath, index_file) as index:
+            positions = index.positions(start_id, end_id)
+            with open_file(outfile, "wb", compression, compression_level) as outf:
+                for position in positions:
+                    line = index.line(position)
+                    if not line.endswith(b"\n"):
+                        line += b"\n"
+                    outf.write(line)
+            STATS.add_docs(len(positions))
@@ -0,0 +1,213 @@
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from pathlib import Path
+from typing import IO, Iterator, List, Optional, Tuple, Union
+
+from furniture_mover.doc_ids import get_doc_id
+
+# layout of an index file:
+#   header:  magic, number of entries, size of the indexed file
+#   entries: offset and length of the line, position and length of the id in
+#            the keys blob. Sorted by the utf-8 bytes of the ids.
+#   keys:    all ids, utf-8 encoded
+INDEX_MAGIC = b"FMIDX001"
+_HEADER = struct.Struct("<8sQQ")
+_ENTRY = struct.Struct("<QIQI")
+# an entry of a sorted run: length of the id, offset and length of the line
+_RUN_ENTRY = struct.Struct("<IQI")
+# entries held in memory before they are sorted and spilled to a run file
+INDEX_RUN_ENTRIES = 200_000
+
+
+def index_path(filepath: Union[str, Path]) -> str:
+    return f"{filepath}.idx"
+
+
+def iter_line_offsets(filepath: Union[str, Path]) -> Iterator[Tuple[str, int, int]]:
+    with open(filepath, mode="rb") as inf:
+        offset = 0
+        for line in inf:
+            if line.strip():
+                yield get_doc_id(line), offset, len(line)
+            offset += len(line)
+
+
+def write_index(
+    filepath: Union[str, Path], index_filepath: Optional[Union[str, Path]] = None
+) -> int:
+    if index_filepath is None:
+        index_filepath = index_path(filepath)
+
+    with IndexWriter(index_filepath) as writer:
+        for doc_id, offset, length in iter_line_offsets(filepath):
+            writer.add(doc_id, offset, length)
+        return writer.finish(os.path.getsize(filepath))
+
+
+class IndexWriter:
+    # collects the lines of a file while it is written. Like an external sort,
+    # the entries are spilled in sorted runs next to the index and merged at the
+    # end, so the memory stays bounded for any number of docs.
+    def __init__(
+        self, index_filepath: Union[str, Path], run_entries: int = INDEX_RUN_ENTRIES
+    ) -> None:
+        self._index_filepath = index_filepath
+        self._run_entries = run_entries
+        self._directory = os.path.dirname(os.path.abspath(index_filepath))
+        self._entries: List[Tuple[bytes, int, int]] = []
+        self._runs: List[IO[bytes]] = []
+        self._count = 0
+
+    def __enter__(self) -> "IndexWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(self, doc_id: str, offset: int, length: int) -> None:
+        self._entries.append((doc_id.encode("utf-8"), offset, length))
+        self._count += 1
+        if len(self._entries) >= self._run_entries:
+            self._spill()
+
+    def finish(self, data_size: int) -> int:
+        if self._runs:
+            self._spill()
+            entries: Iterator[Tuple[bytes, int, int]] = heapq.merge(
+                *[_read_run(run) for run in self._runs]
+            )
+        else:
+            self._entries.sort()
+            entries = iter(self._entries)
+
+        # the keys follow all entries, they are collected in a file of their own
+        # and appended once the entries are written
+        tmp_filepath = f"{self._index_filepath}.tmp"
+        with open(tmp_filepath, mode="wb") as outf, tempfile.TemporaryFile(
+            dir=self._directory
+        ) as keys:
+            outf.write(_HEADER.pack(INDEX_MAGIC, self._count, data_size))
+            key_pos = _HEADER.size + _ENTRY.size * self._count
+            for key, offset, length in entries:
+                outf.write(_ENTRY.pack(offset, length, key_pos, len(key)))
+                keys.write(key)
+                key_pos += len(key)
+            keys.seek(0)
+            shutil.copyfileobj(keys, outf)
+        os.replace(tmp_filepath, self._index_filepath)
+        return self._count
+
+    def close(self) -> None:
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._entries = []
+
+    def _spill(self) -> None:
+        self._entries.sort()
+        run = tempfile.TemporaryFile(dir=self._directory)
+        for key, offset, length in self._entries:
+            run.write(_RUN_ENTRY.pack(len(key), offset, length))
+            run.write(key)
+        run.seek(0)
+        self._runs.append(run)
+        self._entries = []
+
+
+def _read_run(run: IO[bytes]) -> Iterator[Tuple[bytes, int, int]]:
+    while True:
+        header = run.read(_RUN_ENTRY.size)
+        if not header:
+            return
+        key_len, offset, length = _RUN_ENTRY.unpack(header)
+        yield run.read(key_len), offset, length
+
+
+class DocIndex:
+    def __init__(
+        self,
+        filepath: Union[str, Path],
+        index_filepath: Optional[Union[str, Path]] = None,
+    ) -> None:
+        if index_filepath is None:
+            index_filepath = index_path(filepath)
+
+        self._index = _map_file(index_filepath)
+        magic, self._count, data_size = _HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{index_filepath} is not an index file")
+        if os.path.getsize(filepath) != data_size:
+            raise ValueError(
+                f"{index_filepath} does not match {filepath}, "
+                "rebuild it with the index command"
+            )
+        self._data = _map_file(filepath)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> "DocIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for mapped in (self._index, self._data):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def find(self, doc_id: str) -> Optional[bytes]:
+        key = doc_id.encode("utf-8")
+        position = self._bisect(key)
+        if position < self._count and self._key(position) == key:
+            return self.line(position)
+        return None
+
+    def positions(
+        self, start_id: Optional[str] = None, end_id: Optional[str] = None
+    ) -> range:
+        # both ids are inclusive, like startkey and endkey of couchdb
+        start = 0 if start_id is None else self._bisect(start_id.encode("utf-8"))
+        end = (
+            self._count
+            if end_id is None
+            else self._bisect(end_id.encode("utf-8"), right=True)
+        )
+        return range(start, max(start, end))
+
+    def line(self, position: int) -> bytes:
+        offset, length, _, _ = self._entry(position)
+        end = offset + length
+        return self._data[offset:end]
+
+    def _entry(self, position: int) -> Tuple[int, int, int, int]:
+        return _ENTRY.unpack_from(self._index, _HEADER.size + position * _ENTRY.size)
+
+    def _key(self, position: int) -> bytes:
+        _, _, key_pos, key_len = self._entry(position)
+        end = key_pos + key_len
+        return self._index[key_pos:end]
+
+    def _bisect(self, key: bytes, right: bool = False) -> int:
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = self._key(middle)
+            if middle_key < key or (right and middle_key == key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+def _map_file(filepath: Union[str, Path]) -> Union[mmap.mmap, bytes]:
+    # empty files can't be mapped
+    with open(filepath, mode="rb") as inf:
+        if os.fstat(inf.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,144 @@
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+from types import FrameType
+from typing import Any, Iterator, List, Optional, Union
+
+from furniture_mover.stats import STATS, Stats
+
+logger = logging.getLogger("profiling")
+
+TOP_ALLOCATIONS = 25
+PEAK_POLL_INTERVAL = 0.1
+# a new snapshot is only taken once the memory grew by this factor since the last
+PEAK_GROWTH = 1.1
+
+
+class Profile(str, Enum):
+    cpu = "cpu"
+    memory = "memory"
+
+
+DEFAULT_PROFILE_FILES = {
+    Profile.cpu: "furniture_mover.prof",
+    Profile.memory: "furniture_mover.memory.txt",
+}
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    # times a phase of a command into the stats, cheap enough to stay in always
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STATS.observe_span(name, seconds)
+        logger.debug("%s took %.3fs", name, seconds)
+
+
+class Profiler:
+    # cpu writes a pstats file of the thread running the command and the threads
+    # it starts, e.g. for python -m pstats or snakeviz. memory writes the lines
+    # that held the most memory around the peak of the run, traced in all threads.
+    def __init__(
+        self,
+        profile: Profile,
+        filepath: Optional[Union[str, Path]] = None,
+        top: int = TOP_ALLOCATIONS,
+    ) -> None:
+        self.profile = profile
+        self.filepath = filepath or DEFAULT_PROFILE_FILES[profile]
+        self._top = top
+        self._cpu_profile: Optional[cProfile.Profile] = None
+        self._thread_profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._peak_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._peak_snapshot_size = 0
+
+    def start(self) -> None:
+        if self.profile == Profile.cpu:
+            self._cpu_profile = cProfile.Profile()
+            self._cpu_profile.enable()
+            # before 3.12 cProfile only sees the thread that enabled it, e.g. the
+            # workers of a thread pool get a profile of their own
+            if sys.version_info < (3, 12):
+                threading.setprofile(self._profile_thread)
+        else:
+            tracemalloc.start()
+            self._thread = threading.Thread(target=self._watch_peak, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._cpu_profile is not None:
+            threading.setprofile(None)
+            self._cpu_profile.disable()
+            stats = pstats.Stats(self._cpu_profile)
+            with self._lock:
+                for thread_profile in self._thread_profiles:
+                    stats.add(thread_profile)
+            stats.dump_stats(str(self.filepath))
+            return
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._take_peak_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = self._peak_snapshot
+        tracemalloc.stop()
+        if snapshot is None:
+            return
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ]
+        )
+        lines = [
+            f"traced memory: {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB",
+            f"top {self._top} allocations at {self._peak_snapshot_size / 1e6:.1f} MB:",
+        ]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[: self._top]]
+        with open(self.filepath, mode="w", encoding="utf-8") as outf:
+            outf.write("\n".join(lines) + "\n")
+
+    def _profile_thread(self, frame: FrameType, event: str, arg: Any) -> None:
+        # called once at the start of every new thread, cProfile takes over from
+        # there
+        thread_profile = cProfile.Profile()
+        with self._lock:
+            self._thread_profiles.append(thread_profile)
+        thread_profile.enable()
+
+    def _watch_peak(self) -> None:
+        while not self._stop.wait(PEAK_POLL_INTERVAL):
+            self._take_peak_snapshot()
+
+    def _take_peak_snapshot(self) -> None:
+        # tracemalloc only counts the peak, the allocations have to be caught
+        # while the memory is high
+        current = tracemalloc.get_traced_memory()[0]
+        if (
+            self._peak_snapshot is None
+            or current > self._peak_snapshot_size * PEAK_GROWTH
+        ):
+            self._peak_snapshot = tracemalloc.take_snapshot()
+            self._peak_snapshot_size = current
+
+
+def format_spans(stats: Stats = STATS) -> List[str]:
+    return [
+        f"{name}: {span_stats['count']} x, {span_stats['seconds_sum']:.3f}s"
+        for name, span_stats in stats.snapshot()["spans"].items()
+    ]
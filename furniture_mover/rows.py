@@ -0,0 +1,101 @@
+import codecs
+import json
+import re
+from itertools import chain
+from typing import Iterable, Iterator
+
+from furniture_mover.codec import loads
+
+_ROWS_START = re.compile(r'"rows"\s*:\s*\[')
+_ROW_SEPARATORS = " \t\r\n,"
+
+
+def iter_rows(lines: Iterable[bytes]) -> Iterator[dict]:
+    lines = iter(lines)
+    for header in lines:
+        if header.strip():
+            break
+    else:
+        raise ValueError("'rows' missing in json. Response was empty")
+
+    # couchdb writes the header and each row on its own line, so rows can be
+    # decoded line by line. Anything else is handed to the incremental parser.
+    if not header.rstrip().endswith(b'"rows":['):
+        yield from _iter_rows_incremental(chain([header], lines))
+        return
+
+    for line in lines:
+        stripped = line.strip(b" \t\r\n,")
+        if not stripped:
+            continue
+        if stripped.startswith(b"]"):
+            return
+
+        try:
+            row = loads(stripped)
+        except ValueError:
+            row = None
+
+        if not isinstance(row, dict):
+            yield from _iter_rows_incremental(chain([line], lines), in_rows=True)
+            return
+
+        yield row
+
+    raise ValueError("unexpected end of json while reading 'rows'")
+
+
+def _iter_rows_incremental(
+    chunks: Iterable[bytes], in_rows: bool = False
+) -> Iterator[dict]:
+    chunks = iter(chunks)
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+
+    def read_more(min_size: int = 1) -> bool:
+        # grow the buffer geometrically, so a large row does not get re-parsed
+        # once for every small chunk it spans
+        nonlocal buf, pos
+        parts = [buf[pos:]]
+        size = 0
+        for chunk in chunks:
+            text = utf8_decoder.decode(chunk)
+            parts.append(text)
+            size += len(text)
+            if size >= min_size:
+                break
+        buf = "".join(parts)
+        pos = 0
+        return size > 0
+
+    if not in_rows:
+        while True:
+            match = _ROWS_START.search(buf)
+            if match:
+                pos = match.end()
+                break
+            if not read_more():
+                raise ValueError("'rows' missing in json")
+
+    while True:
+        while pos < len(buf) and buf[pos] in _ROW_SEPARATORS:
+            pos += 1
+
+        if pos == len(buf):
+            if not read_more():
+                raise ValueError("unexpected end of json while reading 'rows'")
+            continue
+
+        if buf[pos] == "]":
+            return
+
+        try:
+            row, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if not read_more(len(buf) - pos):
+                raise ValueError("unexpected end of json while reading 'rows'")
+            continue
+
+        yield row
@@ -0,0 +1,279 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+from urllib.parse import urlsplit
+
+# upper bounds of the latency buckets in seconds, the defaults of prometheus
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+PROGRESS_INTERVAL = 1.0
+
+
+class Histogram:
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        position = len(self.buckets)
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                position = i
+                break
+        self.counts[position] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> Dict[str, int]:
+        # like prometheus, every bucket counts all values up to its bound
+        cumulative: Dict[str, int] = {}
+        total = 0
+        for bucket, count in zip(self.buckets + [float("inf")], self.counts):
+            total += count
+            cumulative["+Inf" if bucket == float("inf") else str(bucket)] = total
+        return cumulative
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.errors = 0
+        self.retries = 0
+
+
+class Stats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._started = time.monotonic()
+            self.docs = 0
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.requests: Dict[str, RequestStats] = {}
+            self.batches = 0
+            self.batch_docs = 0
+            self.batch_bytes = 0
+            self.max_batch_docs = 0
+            self.max_batch_bytes = 0
+            self.spans: Dict[str, Histogram] = {}
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    def add_docs(self, count: int) -> None:
+        with self._lock:
+            self.docs += count
+
+    def add_bytes(self, sent: int = 0, received: int = 0) -> None:
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def observe_request(
+        self, endpoint: str, seconds: float, error: bool = False, retries: int = 0
+    ) -> None:
+        with self._lock:
+            request_stats = self.requests.setdefault(endpoint, RequestStats())
+            request_stats.latency.observe(seconds)
+            request_stats.errors += error
+            request_stats.retries += retries
+
+    def observe_batch(self, docs: int, payload_bytes: int) -> None:
+        with self._lock:
+            self.batches += 1
+            self.batch_docs += docs
+            self.batch_bytes += payload_bytes
+            self.max_batch_docs = max(self.max_batch_docs, docs)
+            self.max_batch_bytes = max(self.max_batch_bytes, payload_bytes)
+
+    def observe_span(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.spans.setdefault(name, Histogram()).observe(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = self.elapsed
+            return {
+                "elapsed_seconds": elapsed,
+                "docs": self.docs,
+                "docs_per_second": self.docs / elapsed if elapsed else 0.0,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "bytes_per_second": (
+                    (self.bytes_sent + self.bytes_received) / elapsed
+                    if elapsed
+                    else 0.0
+                ),
+                "requests": {
+                    endpoint: {
+                        "count": request_stats.latency.count,
+                        "errors": request_stats.errors,
+                        "retries": request_stats.retries,
+                        "latency_seconds_sum": request_stats.latency.sum,
+                        "latency_seconds_buckets": request_stats.latency.cumulative(),
+                    }
+                    for endpoint, request_stats in sorted(self.requests.items())
+                },
+                "batches": {
+                    "count": self.batches,
+                    "docs": self.batch_docs,
+                    "bytes": self.batch_bytes,
+                    "max_docs": self.max_batch_docs,
+                    "max_bytes": self.max_batch_bytes,
+                },
+                "spans": {
+                    name: {
+                        "count": histogram.count,
+                        "seconds_sum": histogram.sum,
+                        "seconds_buckets": histogram.cumulative(),
+                    }
+                    for name, histogram in sorted(self.spans.items())
+                },
+            }
+
+
+STATS = Stats()
+
+
+def endpoint_name(method: str, url: str) -> str:
+    # e.g. "POST _bulk_docs", requests to a database itself are "PUT db"
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+    if len(parts) > 1 and parts[-1].startswith("_"):
+        return f"{method} {parts[-1]}"
+    if len(parts) > 1:
+        return f"{method} doc"
+    return f"{method} db"
+
+
+def write_stats_file(filepath: Union[str, Path], stats: Stats = STATS) -> None:
+    _write_atomic(filepath, json.dumps(stats.snapshot(), indent=2) + "\n")
+
+
+def write_prometheus_file(filepath: Union[str, Path], stats: Stats = STATS) -> None:
+    # textfile format of the node_exporter textfile collector
+    snapshot = stats.snapshot()
+    lines = [
+        "# TYPE furniture_mover_elapsed_seconds gauge",
+        f"furniture_mover_elapsed_seconds {snapshot['elapsed_seconds']}",
+        "# TYPE furniture_mover_docs_total counter",
+        f"furniture_mover_docs_total {snapshot['docs']}",
+        "# TYPE furniture_mover_bytes_total counter",
+        f'furniture_mover_bytes_total{{direction="sent"}} {snapshot["bytes_sent"]}',
+        f'furniture_mover_bytes_total{{direction="received"}} '
+        f'{snapshot["bytes_received"]}',
+        "# TYPE furniture_mover_batches_total counter",
+        f"furniture_mover_batches_total {snapshot['batches']['count']}",
+        "# TYPE furniture_mover_batch_docs_total counter",
+        f"furniture_mover_batch_docs_total {snapshot['batches']['docs']}",
+        "# TYPE furniture_mover_batch_bytes_total counter",
+        f"furniture_mover_batch_bytes_total {snapshot['batches']['bytes']}",
+    ]
+
+    requests = snapshot["requests"]
+    lines.append("# TYPE furniture_mover_request_duration_seconds histogram")
+    for endpoint, request_stats in requests.items():
+        labels = _endpoint_labels(endpoint)
+        for bucket, count in request_stats["latency_seconds_buckets"].items():
+            lines.append(
+                f'furniture_mover_request_duration_seconds_bucket{{{labels},le="{bucket}"}}'
+                f" {count}"
+            )
+        lines.append(
+            f"furniture_mover_request_duration_seconds_sum{{{labels}}} "
+            f"{request_stats['latency_seconds_sum']}"
+        )
+        lines.append(
+            f"furniture_mover_request_duration_seconds_count{{{labels}}} "
+            f"{request_stats['count']}"
+        )
+    for name in ("errors", "retries"):
+        lines.append(f"# TYPE furniture_mover_request_{name}_total counter")
+        for endpoint, request_stats in requests.items():
+            lines.append(
+                f"furniture_mover_request_{name}_total{{{_endpoint_labels(endpoint)}}} "
+                f"{request_stats[name]}"
+            )
+
+    lines.append("# TYPE furniture_mover_span_duration_seconds histogram")
+    for name, span_stats in snapshot["spans"].items():
+        labels = f'span="{name}"'
+        for bucket, count in span_stats["seconds_buckets"].items():
+            lines.append(
+                f'furniture_mover_span_duration_seconds_bucket{{{labels},le="{bucket}"}}'
+                f" {count}"
+            )
+        lines.append(
+            f"furniture_mover_span_duration_seconds_sum{{{labels}}} "
+            f"{span_stats['seconds_sum']}"
+        )
+        lines.append(
+            f"furniture_mover_span_duration_seconds_count{{{labels}}} "
+            f"{span_stats['count']}"
+        )
+    _write_atomic(filepath, "\n".join(lines) + "\n")
+
+
+def _endpoint_labels(endpoint: str) -> str:
+    method, name = endpoint.split(" ", 1)
+    return f'method="{method}",endpoint="{name}"'
+
+
+def _write_atomic(filepath: Union[str, Path], text: str) -> None:
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, mode="w", encoding="utf-8") as outf:
+        outf.write(text)
+    os.replace(tmp_filepath, filepath)
+
+
+class ProgressReporter:
+    # prints a status line with the rates since the previous line
+    def __init__(
+        self,
+        write: Callable[[str], None],
+        stats: Stats = STATS,
+        interval: float = PROGRESS_INTERVAL,
+    ) -> None:
+        self._write = write
+        self._stats = stats
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last = (0.0, 0, 0)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._report()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            self._report()
+
+    def _report(self) -> None:
+        snapshot = self._stats.snapshot()
+        elapsed = snapshot["elapsed_seconds"]
+        transferred = snapshot["bytes_sent"] + snapshot["bytes_received"]
+        last_elapsed, last_docs, last_transferred = self._last
+        seconds = max(elapsed - last_elapsed, 1e-9)
+        self._last = (elapsed, snapshot["docs"], transferred)
+
+        self._write(
+            f"{elapsed:.0f}s: {snapshot['docs']} docs "
+            f"({(snapshot['docs'] - last_docs) / seconds:.0f} docs/s), "
+            f"{transferred / 1e6:.1f} MB "
+            f"({(transferred - last_transferred) / 1e6 / seconds:.2f} MB/s), "
+            f"{sum(r['count'] for r in snapshot['requests'].values())} requests"
+        )
@@ -0,0 +1,82 @@
+import json
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+from furniture_mover.async_couch import Engine
+from tests.benchmarks.scenarios import (
+    SCENARIOS,
+    Dataset,
+    Result,
+    Scenario,
+    Settings,
+    Workspace,
+)
+from tests.fake_couch import FakeCouch
+
+app = typer.Typer()
+
+
+@app.command()
+def main(
+    scenario: List[Scenario] = typer.Option(list(Scenario)),
+    docs: int = typer.Option(10000, min=1),
+    doc_size: int = typer.Option(1024, min=0),
+    revisions: int = typer.Option(1, min=1),
+    latency: float = typer.Option(0.0, min=0),
+    bandwidth: Optional[int] = typer.Option(None, min=1),
+    workers: int = typer.Option(1, min=1),
+    engine: Engine = typer.Option(Engine.sync),
+    page_size: int = typer.Option(1000, min=1),
+    batch_size: int = typer.Option(1000, min=1),
+    output: Optional[Path] = typer.Option(None),
+) -> None:
+    dataset = Dataset(docs, doc_size, revisions)
+    settings = Settings(workers, engine.value, page_size, batch_size)
+    results: List[Result] = []
+    with tempfile.TemporaryDirectory() as directory, FakeCouch(
+        latency, bandwidth
+    ) as fake:
+        typer.echo(f"generating {docs} docs of {doc_size} bytes, revision {revisions}")
+        workspace = Workspace(Path(directory), fake, dataset, settings)
+        workspace.prepare()
+
+        typer.echo(
+            f"{'scenario':<28}{'docs':>10}{'seconds':>10}{'docs/s':>10}"
+            f"{'MB/s':>10}{'peak MB':>10}"
+        )
+        for name in scenario:
+            result = SCENARIOS[name](workspace)
+            results.append(result)
+            typer.echo(
+                f"{result.scenario:<28}{result.docs:>10}{result.seconds:>10.2f}"
+                f"{result.docs_per_second:>10.0f}{result.megabytes_per_second:>10.2f}"
+                f"{result.peak_memory_mb:>10.1f}"
+            )
+
+    if output is not None:
+        with open(output, "w", encoding="utf-8") as outf:
+            json.dump(
+                {
+                    "dataset": dataset._asdict(),
+                    "settings": settings._asdict(),
+                    "latency": latency,
+                    "bandwidth": bandwidth,
+                    "results": [
+                        dict(
+                            result._asdict(),
+                            docs_per_second=result.docs_per_second,
+                            megabytes_per_second=result.megabytes_per_second,
+                        )
+                        for result in results
+                    ],
+                },
+                outf,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import random
+import string
+from pathlib import Path
+from typing import Iterator
+
+from furniture_mover.codec import dumps_line
+from tests.fake_couch import FakeCouch
+
+FILLER_CHARACTERS = string.ascii_letters + string.digits
+
+
+def make_doc(number: int, doc_size: int) -> dict:
+    # seeded by the number, so every run and every file gets the same docs
+    filler = "".join(random.Random(number).choices(FILLER_CHARACTERS, k=doc_size))
+    return {"_id": f"doc{number:08d}", "number": number, "filler": filler}
+
+
+def iter_docs(doc_count: int, doc_size: int) -> Iterator[dict]:
+    for number in range(doc_count):
+        yield make_doc(number, doc_size)
+
+
+def seed_db(
+    fake: FakeCouch, db: str, doc_count: int, doc_size: int, revisions: int
+) -> None:
+    fake.create_db(db)
+    for doc in iter_docs(doc_count, doc_size):
+        fake.put_doc(db, doc, rev_num=revisions)
+
+
+def write_export_file(
+    filepath: Path, doc_count: int, doc_size: int, revisions: int
+) -> None:
+    with open(filepath, "wb") as outf:
+        for doc in iter_docs(doc_count, doc_size):
+            outf.write(dumps_line(_with_rev(doc, revisions)))
+
+
+def write_all_docs_file(
+    filepath: Path, doc_count: int, doc_size: int, revisions: int
+) -> None:
+    # the layout of _all_docs?include_docs=true as couchdb writes it
+    with open(filepath, "w", encoding="utf-8") as outf:
+        outf.write(f'{{"total_rows":{doc_count},"offset":0,"rows":[\r\n')
+        for doc in iter_docs(doc_count, doc_size):
+            doc = _with_rev(doc, revisions)
+            row = {"id": doc["_id"], "key": doc["_id"], "value": {"rev": doc["_rev"]}}
+            row["doc"] = doc
+            if doc["number"] > 0:
+                outf.write(",\r\n")
+            outf.write(json.dumps(row))
+        outf.write("\r\n]}\n")
+
+
+def write_filter_file(filepath: Path, output_dir: Path) -> None:
+    # splits the docs by the last digit of their id
+    filters = [
+        {
+            "filepath": str(output_dir / "even.json"),
+            "regex_filters": [r"doc\d*[02468]$"],
+        },
+        {
+            "filepath": str(output_dir / "odd.json"),
+            "regex_filters": [r"doc\d*[13579]$"],
+        },
+    ]
+    with open(filepath, "w", encoding="utf-8") as outf:
+        json.dump(filters, outf)
+
+
+def _with_rev(doc: dict, revisions: int) -> dict:
+    digest = hashlib.md5(doc["_id"].encode("utf-8")).hexdigest()
+    return dict({"_id": doc["_id"], "_rev": f"{revisions}-{digest}"}, **doc)
@@ -0,0 +1,205 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple
+
+from tests.benchmarks import datasets
+from tests.fake_couch import FakeCouch
+
+REPO_DIR = Path(__file__).resolve().parents[2]
+SOURCE_DB = "benchmark_source"
+
+
+class Scenario(str, Enum):
+    export = "export"
+    export_stream = "export_stream"
+    import_same_revision = "import_same_revision"
+    import_no_same_revision = "import_no_same_revision"
+    filter = "filter"
+    export_from_all_docs_file = "export_from_all_docs_file"
+
+
+class Dataset(NamedTuple):
+    doc_count: int
+    doc_size: int
+    revisions: int
+
+
+class Settings(NamedTuple):
+    workers: int
+    engine: str
+    page_size: int
+    batch_size: int
+
+
+class Result(NamedTuple):
+    scenario: str
+    docs: int
+    megabytes: float
+    seconds: float
+    peak_memory_mb: float
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.docs / self.seconds
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.megabytes / self.seconds
+
+
+class Workspace:
+    # the inputs every scenario may use, generated once per run
+    def __init__(
+        self, directory: Path, fake: FakeCouch, dataset: Dataset, settings: Settings
+    ) -> None:
+        self.directory = directory
+        self.fake = fake
+        self.dataset = dataset
+        self.settings = settings
+        self.export_file = directory / "export.json"
+        self.all_docs_file = directory / "all_docs.json"
+        self.filter_file = directory / "filter.json"
+        self.output_dir = directory / "output"
+        self._runs = 0
+
+    def prepare(self) -> None:
+        doc_count, doc_size, revisions = self.dataset
+        self.output_dir.mkdir()
+        datasets.seed_db(self.fake, SOURCE_DB, doc_count, doc_size, revisions)
+        datasets.write_export_file(self.export_file, doc_count, doc_size, revisions)
+        datasets.write_all_docs_file(self.all_docs_file, doc_count, doc_size, revisions)
+        datasets.write_filter_file(self.filter_file, self.output_dir)
+
+    def output_file(self) -> Path:
+        self._runs += 1
+        return self.output_dir / f"run{self._runs}.json"
+
+    def target_db(self) -> str:
+        self._runs += 1
+        return f"benchmark_target_{self._runs}"
+
+
+def run_command(
+    name: str, args: List[str], workspace: Workspace, data_file: Path
+) -> Result:
+    # every scenario runs the cli in its own process, so the peak memory is
+    # only the one of that command
+    stats_file = workspace.directory / "stats.json"
+    env = dict(os.environ, PYTHONPATH=str(REPO_DIR))
+    started = time.monotonic()
+    # no furniture_mover.ini in the working directory, so nothing gets logged
+    process = subprocess.Popen(
+        [sys.executable, "-m", "furniture_mover", "--stats-file", str(stats_file)]
+        + args,
+        cwd=workspace.directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    stderr = process.stderr.read() if process.stderr is not None else b""
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.monotonic() - started
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    if process.returncode != 0:
+        sys.exit(f"Scenario {name} failed: {stderr.decode('utf-8').strip()}")
+
+    with open(stats_file, "r", encoding="utf-8") as inf:
+        docs = json.load(inf)["docs"]
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    peak_memory = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return Result(
+        name, docs, data_file.stat().st_size / 1e6, seconds, peak_memory / 1e6
+    )
+
+
+def export(workspace: Workspace) -> Result:
+    return _export("export", [], workspace)
+
+
+def export_stream(workspace: Workspace) -> Result:
+    return _export("export_stream", ["--stream"], workspace)
+
+
+def _export(name: str, options: List[str], workspace: Workspace) -> Result:
+    outfile = workspace.output_file()
+    settings = workspace.settings
+    args = [
+        "export",
+        str(outfile),
+        SOURCE_DB,
+        "--url",
+        workspace.fake.url,
+        "--page-size",
+        str(settings.page_size),
+        "--workers",
+        str(settings.workers),
+    ]
+    # the asyncio engine doesn't stream
+    if "--stream" not in options:
+        args += ["--engine", settings.engine]
+    return run_command(name, args + options, workspace, outfile)
+
+
+def import_same_revision(workspace: Workspace) -> Result:
+    return _import("import_same_revision", ["--same-revision"], workspace)
+
+
+def import_no_same_revision(workspace: Workspace) -> Result:
+    return _import("import_no_same_revision", ["--no-same-revision"], workspace)
+
+
+def _import(name: str, options: List[str], workspace: Workspace) -> Result:
+    db = workspace.target_db()
+    settings = workspace.settings
+    args = [
+        "import",
+        str(workspace.export_file),
+        db,
+        "--url",
+        workspace.fake.url,
+        "--batch-size",
+        str(settings.batch_size),
+        "--workers",
+        str(settings.workers),
+        "--engine",
+        settings.engine,
+    ]
+    try:
+        return run_command(name, args + options, workspace, workspace.export_file)
+    finally:
+        # the target is not needed anymore, free the memory of the fake
+        workspace.fake.dbs.pop(db, None)
+
+
+def filter(workspace: Workspace) -> Result:
+    args = [
+        "filter",
+        str(workspace.filter_file),
+        str(workspace.export_file),
+        "--workers",
+        str(workspace.settings.workers),
+    ]
+    return run_command("filter", args, workspace, workspace.export_file)
+
+
+def export_from_all_docs_file(workspace: Workspace) -> Result:
+    outfile = workspace.output_file()
+    args = ["export_from_all_docs_file", str(workspace.all_docs_file), str(outfile)]
+    return run_command(
+        "export_from_all_docs_file", args, workspace, workspace.all_docs_file
+    )
+
+
+SCENARIOS: Dict[Scenario, Callable[[Workspace], Result]] = {
+    Scenario.export: export,
+    Scenario.export_stream: export_stream,
+    Scenario.import_same_revision: import_same_revision,
+    Scenario.import_no_same_revision: import_no_same_revision,
+    Scenario.filter: filter,
+    Scenario.export_from_all_docs_file: export_from_all_docs_file,
+}
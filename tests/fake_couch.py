@@ -0,0 +1,300 @@
+import bisect
+import gzip
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class FakeCouch:
+    # a stand-in for the parts of the couchdb api furniture_mover uses, kept in
+    # memory and served on a random local port. latency (seconds per request)
+    # and bandwidth (bytes per second of bodies) simulate a remote server.
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[int] = None) -> None:
+        self.dbs: Dict[str, Dict[str, dict]] = {}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        # like a proxy in front of couchdb, which can compress the traffic
+        self.accept_gzip = True
+        self.max_request_size: Optional[int] = None
+        self.gzip_requests = 0
+        self.gzip_responses = 0
+        self._update_seqs: Dict[str, int] = {}
+        self._sorted_ids: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        # clients drop keep-alive connections, e.g. after a 413
+        self._server.handle_error = lambda request, client_address: None  # type: ignore
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeCouch":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def create_db(self, db: str) -> None:
+        self.dbs[db] = {}
+        self._update_seqs[db] = 0
+        self._sorted_ids.pop(db, None)
+
+    def put_doc(self, db: str, doc: dict, rev_num: int = 1) -> None:
+        if db not in self.dbs:
+            self.create_db(db)
+        body = {key: value for key, value in doc.items() if not key.startswith("_")}
+        self._write(db, doc["_id"], _make_rev(rev_num, body), body, False)
+
+    def delete_doc(self, db: str, doc_id: str) -> None:
+        rev_num = _rev_num(self.dbs[db][doc_id]["rev"]) + 1
+        self._write(db, doc_id, _make_rev(rev_num, {}), {}, True)
+
+    def get_docs(self, db: str) -> Dict[str, dict]:
+        return {
+            doc_id: dict({"_id": doc_id, "_rev": doc["rev"]}, **doc["body"])
+            for doc_id, doc in self.dbs[db].items()
+            if not doc["deleted"]
+        }
+
+    def _write(self, db: str, doc_id: str, rev: str, body: dict, deleted: bool) -> None:
+        if doc_id not in self.dbs[db]:
+            self._sorted_ids.pop(db, None)
+        self._update_seqs[db] += 1
+        self.dbs[db][doc_id] = {
+            "rev": rev,
+            "body": body,
+            "deleted": deleted,
+            "seq": self._update_seqs[db],
+        }
+
+    def _ids(self, db: str) -> List[str]:
+        if db not in self._sorted_ids:
+            self._sorted_ids[db] = sorted(self.dbs[db])
+        return self._sorted_ids[db]
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                self._route("GET")
+
+            def do_PUT(self) -> None:
+                self._route("PUT")
+
+            def do_POST(self) -> None:
+                self._route("POST")
+
+            def _send(self, status: int, data: Any = None, raw: bytes = b"") -> None:
+                body = raw or json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    fake.gzip_responses += 1
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self._transfer(len(body))
+                self.wfile.write(body)
+
+            def _transfer(self, size: int) -> None:
+                if fake.bandwidth:
+                    time.sleep(size / fake.bandwidth)
+
+            def _route(self, method: str) -> None:
+                if fake.latency:
+                    time.sleep(fake.latency)
+                url = urlsplit(self.path)
+                query = {key: value[0] for key, value in parse_qs(url.query).items()}
+                path = [unquote(part) for part in url.path.split("/") if part]
+                length = int(self.headers.get("Content-Length", 0))
+                data = self.rfile.read(length)
+                self._transfer(length)
+                if fake.max_request_size is not None and length > fake.max_request_size:
+                    return self._send(413, {"error": "too_large"})
+                if self.headers.get("Content-Encoding") == "gzip":
+                    if not fake.accept_gzip:
+                        return self._send(415, {"error": "bad_content_type"})
+                    fake.gzip_requests += 1
+                    data = gzip.decompress(data)
+                body = json.loads(data) if data else None
+
+                with fake._lock:
+                    db = path[0]
+                    if len(path) == 1 and method == "PUT":
+                        if db in fake.dbs:
+                            return self._send(412, {"error": "file_exists"})
+                        fake.create_db(db)
+                        return self._send(201, {"ok": True})
+
+                    if db not in fake.dbs:
+                        return self._send(404, {"error": "not_found"})
+                    if len(path) == 1:
+                        doc_count = sum(
+                            not doc["deleted"] for doc in fake.dbs[db].values()
+                        )
+                        return self._send(
+                            200,
+                            {
+                                "db_name": db,
+                                "doc_count": doc_count,
+                                "update_seq": f"{fake._update_seqs[db]}-fake",
+                            },
+                        )
+                    if method == "POST" and body is None:
+                        return self._send(400, {"error": "bad_request"})
+                    if path[1] == "_all_docs":
+                        keys = body["keys"] if body is not None else None
+                        return self._send(200, raw=self._all_docs(db, query, keys))
+                    if path[1] == "_bulk_docs" and body is not None:
+                        return self._send(201, self._bulk_docs(db, body))
+                    if path[1] == "_changes":
+                        return self._send(200, self._changes(db, query))
+                    return self._send(404, {"error": "not_found"})
+
+            def _all_docs(
+                self, db: str, query: Dict[str, str], keys: Optional[list]
+            ) -> bytes:
+                docs = fake.dbs[db]
+                if keys is None:
+                    doc_ids = fake._ids(db)
+                    start = 0
+                    end = len(doc_ids)
+                    if "startkey" in query:
+                        start = bisect.bisect_left(
+                            doc_ids, json.loads(query["startkey"])
+                        )
+                    if "endkey" in query:
+                        endkey = json.loads(query["endkey"])
+                        if query.get("inclusive_end") == "false":
+                            end = bisect.bisect_left(doc_ids, endkey)
+                        else:
+                            end = bisect.bisect_right(doc_ids, endkey)
+                    doc_ids = [
+                        doc_id
+                        for doc_id in doc_ids[start:end]
+                        if not docs[doc_id]["deleted"]
+                    ]
+                else:
+                    doc_ids = keys
+                skip = int(query.get("skip", 0))
+                doc_ids = doc_ids[skip:]
+                if "limit" in query:
+                    doc_ids = doc_ids[: int(query["limit"])]
+
+                rows = []
+                for doc_id in doc_ids:
+                    if doc_id not in docs:
+                        rows.append(json.dumps({"key": doc_id, "error": "not_found"}))
+                        continue
+                    doc = docs[doc_id]
+                    row: Dict[str, Any] = {
+                        "id": doc_id,
+                        "key": doc_id,
+                        "value": {"rev": doc["rev"]},
+                    }
+                    if doc["deleted"]:
+                        row["value"]["deleted"] = True
+                    if query.get("include_docs") == "true":
+                        row["doc"] = _full_doc(doc_id, doc)
+                    rows.append(json.dumps(row))
+
+                # the layout couchdb writes: the header and every row on a line
+                total_rows = sum(not doc["deleted"] for doc in docs.values())
+                return (
+                    f'{{"total_rows":{total_rows},"offset":{skip},"rows":[\r\n'
+                    + ",\r\n".join(rows)
+                    + "\r\n]}\n"
+                ).encode("utf-8")
+
+            def _changes(self, db: str, query: Dict[str, str]) -> dict:
+                since = int(str(query.get("since", 0)).split("-")[0])
+                changes = sorted(
+                    (doc["seq"], doc_id)
+                    for doc_id, doc in fake.dbs[db].items()
+                    if doc["seq"] > since
+                )
+                pending = len(changes)
+                if "limit" in query:
+                    changes = changes[: int(query["limit"])]
+
+                results = []
+                for seq, doc_id in changes:
+                    doc = fake.dbs[db][doc_id]
+                    result: Dict[str, Any] = {
+                        "seq": f"{seq}-fake",
+                        "id": doc_id,
+                        "changes": [{"rev": doc["rev"]}],
+                    }
+                    if doc["deleted"]:
+                        result["deleted"] = True
+                    if query.get("include_docs") == "true":
+                        result["doc"] = _full_doc(doc_id, doc)
+                    results.append(result)
+                last_seq = results[-1]["seq"] if results else f"{since}-fake"
+                return {
+                    "results": results,
+                    "last_seq": last_seq,
+                    "pending": pending - len(results),
+                }
+
+            def _bulk_docs(self, db: str, payload: dict) -> list:
+                docs = fake.dbs[db]
+                doc_infos = []
+                for doc in payload["docs"]:
+                    doc_id = doc["_id"]
+                    body = {
+                        key: value
+                        for key, value in doc.items()
+                        if not key.startswith("_")
+                    }
+                    deleted = bool(doc.get("_deleted"))
+                    current = docs.get(doc_id)
+                    if payload.get("new_edits", True) is False:
+                        rev_num = _rev_num(doc["_rev"])
+                        if current is None or _rev_num(current["rev"]) < rev_num:
+                            fake._write(db, doc_id, doc["_rev"], body, deleted)
+                        continue
+
+                    current_rev = None
+                    if current is not None and not current["deleted"]:
+                        current_rev = current["rev"]
+                    if doc.get("_rev") != current_rev:
+                        doc_infos.append({"id": doc_id, "error": "conflict"})
+                        continue
+                    rev = _make_rev(
+                        _rev_num(current["rev"]) + 1 if current else 1, body
+                    )
+                    fake._write(db, doc_id, rev, body, deleted)
+                    doc_infos.append({"ok": True, "id": doc_id, "rev": rev})
+                return doc_infos
+
+        return Handler
+
+
+def _full_doc(doc_id: str, doc: dict) -> dict:
+    full = dict({"_id": doc_id, "_rev": doc["rev"]}, **doc["body"])
+    if doc["deleted"]:
+        full["_deleted"] = True
+    return full
+
+
+def _rev_num(rev: str) -> int:
+    return int(rev.split("-")[0])
+
+
+def _make_rev(rev_num: int, body: dict) -> str:
+    digest = hashlib.md5(json.dumps([rev_num, body]).encode("utf-8")).hexdigest()
+    return f"{rev_num}-{digest}"
@@ -1,6 +1,10 @@
+from typing import Iterator
+
 import pytest
 from requests_toolbelt import sessions
 
+from tests.fake_couch import FakeCouch
+
 MASTER_DB = "master_testdb"
 
 DOCS = [
@@ -48,3 +52,11 @@ def drop_dbs() -> None:
                 continue
             response = client.delete(f"{db}")
             assert response.status_code == 200
+
+
+@pytest.fixture(scope="function")
+def fake_couch() -> Iterator[FakeCouch]:
+    with FakeCouch() as couch:
+        for rev, doc in DOCS:
+            couch.put_doc(MASTER_DB, doc, rev)
+        yield couch
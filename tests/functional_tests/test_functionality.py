@@ -1,10 +1,24 @@
+import asyncio
+import gzip
 import json
+import lzma
+import os
+import pstats
 from tempfile import NamedTemporaryFile
 
+import pytest
 from requests_toolbelt import sessions
 from typer.testing import CliRunner
 
+from furniture_mover import codec
 from furniture_mover.__main__ import app
+from furniture_mover.async_couch import AsyncCouchDb
+from furniture_mover.compression import open_file
+from furniture_mover.config import Config
+from furniture_mover.couch import CouchDb
+from furniture_mover.index import IndexWriter, iter_line_offsets
+from tests.benchmarks.__main__ import app as benchmarks_app
+from tests.benchmarks.scenarios import Scenario
 from tests.functional_tests.conftest import DOCS, MASTER_DB, get_rev_num_from_doc
 
 runner = CliRunner()
@@ -450,6 +464,242 @@ def test_export_from_all_docs_file():
         assert outf.read() == expected_output
 
 
+def test_export_from_all_docs_file_pretty_printed():
+    rows = [
+        {
+            "id": "testdoc_1",
+            "key": "testdoc_1",
+            "value": {"rev": "3-825cb35de44c433bfb2df415563a19de"},
+            "doc": {"_id": "testdoc_1", "_rev": "3-825cb35de44c433bfb2df415563a19de"},
+        },
+        {
+            "id": "testdoc_2",
+            "key": "testdoc_2",
+            "value": {"rev": "1-c3d84a0ca6114a8e8fbef75dc8c7be00"},
+            "doc": {
+                "_id": "testdoc_2",
+                "_rev": "1-c3d84a0ca6114a8e8fbef75dc8c7be00",
+                "test": "ü",
+            },
+        },
+    ]
+
+    with NamedTemporaryFile() as tmpfile1:
+        filename1 = tmpfile1.name
+        print(filename1)
+    with NamedTemporaryFile() as tmpfile2:
+        filename2 = tmpfile2.name
+        print(filename2)
+
+    # not the line per row layout of couchdb, so the rows are parsed incrementally
+    with open(filename1, "w", encoding="utf8") as inf:
+        inf.write(json.dumps({"total_rows": 2, "offset": 0, "rows": rows}, indent=4))
+
+    result = runner.invoke(app, ["export_from_all_docs_file", filename1, filename2])
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open(filename2, "r", encoding="utf8") as outf:
+        assert [json.loads(line) for line in outf] == [row["doc"] for row in rows]
+
+
+def test_export_from_all_docs_file_compressed():
+    data = """
+{"total_rows":2,"offset":0,"rows":[
+{"id":"testdoc_1","key":"testdoc_1","value":{"rev":"3-825cb35de44c433bfb2df415563a19de"},"doc":{"_id":"testdoc_1","_rev":"3-825cb35de44c433bfb2df415563a19de"}},
+{"id":"testdoc_2","key":"testdoc_2","value":{"rev":"1-c3d84a0ca6114a8e8fbef75dc8c7be00"},"doc":{"_id":"testdoc_2","_rev":"1-c3d84a0ca6114a8e8fbef75dc8c7be00","test":"test"}}
+]}
+    """.strip()
+
+    with NamedTemporaryFile(suffix=".gz") as tmpfile1:
+        filename1 = tmpfile1.name
+        print(filename1)
+    with NamedTemporaryFile(suffix=".xz") as tmpfile2:
+        filename2 = tmpfile2.name
+        print(filename2)
+
+    with gzip.open(filename1, "wt", encoding="utf8") as inf:
+        inf.write(data)
+
+    result = runner.invoke(app, ["export_from_all_docs_file", filename1, filename2])
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    expected_output = """
+{"_id": "testdoc_1", "_rev": "3-825cb35de44c433bfb2df415563a19de"}
+{"_id": "testdoc_2", "_rev": "1-c3d84a0ca6114a8e8fbef75dc8c7be00", "test": "test"}
+""".lstrip()
+
+    with lzma.open(filename2, "rt", encoding="utf8") as outf:
+        assert outf.read() == expected_output
+
+    # every format accepts the levels of --compression-level, bz2 starts at 1
+    for suffix in [".gz", ".bz2", ".xz", ".fmb"]:
+        result = runner.invoke(
+            app,
+            [
+                "export_from_all_docs_file",
+                "--compression-level",
+                "0",
+                filename1,
+                f"{filename2}{suffix}",
+            ],
+        )
+        assert result.exit_code == 0
+        with open_file(f"{filename2}{suffix}", "rb") as outf:
+            assert outf.read().decode("utf8") == expected_output
+        os.remove(f"{filename2}{suffix}")
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"_id": "testdoc_1", "int": 1, "float": 1.5, "list": [None, True, "\u00fc"]},
+        2**64 - 1,
+        # beyond 64 bit and lone surrogates are left to json
+        2**70,
+        {"_id": "testdoc_1", "int": -9999999999999999999},
+        -(2**63),
+        {"_id": "testdoc_1", "big": -(10**30), "float": 1e300},
+        "\ud800",
+        {"_id": "testdoc_\udc00"},
+        "12345678901234567890123",
+    ],
+)
+def test_codec_round_trip_matches_json(value):
+    pytest.importorskip("orjson")
+    expected = json.loads(json.dumps(value))
+
+    # repr, as 2 ** 70 == float(2 ** 70)
+    assert repr(codec.loads(codec.dumps(value))) == repr(expected)
+    assert repr(codec.loads(json.dumps(value))) == repr(expected)
+    assert repr(codec.loads(json.dumps(value).encode("utf-8"))) == repr(expected)
+
+
+def test_index_lookup_and_extract():
+    data = """
+{"total_rows":3,"offset":0,"rows":[
+{"id":"testdoc_1","key":"testdoc_1","value":{"rev":"3-825cb35de44c433bfb2df415563a19de"},"doc":{"_id":"testdoc_1","_rev":"3-825cb35de44c433bfb2df415563a19de"}},
+{"id":"testdoc_2","key":"testdoc_2","value":{"rev":"1-c3d84a0ca6114a8e8fbef75dc8c7be00"},"doc":{"_id":"testdoc_2","_rev":"1-c3d84a0ca6114a8e8fbef75dc8c7be00","test":"test"}},
+{"id":"testdoc_3","key":"testdoc_3","value":{"rev":"15-305afde91ffef71edcff06458e17c186"},"doc":{"_id":"testdoc_3","_rev":"15-305afde91ffef71edcff06458e17c186","test":"test","another":"test"}}
+]}
+    """.strip()
+
+    with NamedTemporaryFile() as tmpfile1:
+        filename1 = tmpfile1.name
+        print(filename1)
+    with NamedTemporaryFile() as tmpfile2:
+        filename2 = tmpfile2.name
+        print(filename2)
+    with NamedTemporaryFile() as tmpfile3:
+        filename3 = tmpfile3.name
+        print(filename3)
+
+    with open(filename1, "w", encoding="utf8") as inf:
+        inf.write(data)
+
+    result = runner.invoke(
+        app, ["export_from_all_docs_file", "--index", filename1, filename2]
+    )
+    print(result.stdout)
+    assert result.exit_code == 0
+    assert os.path.exists(f"{filename2}.idx")
+
+    result = runner.invoke(app, ["lookup", filename2, "testdoc_2"])
+    assert result.exit_code == 0
+    assert result.stdout == (
+        '{"_id": "testdoc_2", "_rev": "1-c3d84a0ca6114a8e8fbef75dc8c7be00", '
+        '"test": "test"}\n'
+    )
+
+    result = runner.invoke(app, ["lookup", filename2, "testdoc_4"])
+    assert result.exit_code == 1
+
+    result = runner.invoke(
+        app, ["extract", "--start-id", "testdoc_2", filename2, filename3]
+    )
+    assert result.exit_code == 0
+
+    with open(filename3, "r", encoding="utf8") as outf:
+        assert [json.loads(line)["_id"] for line in outf] == ["testdoc_2", "testdoc_3"]
+
+
+def test_export_index_written_with_the_file(fake_couch, tmp_path):
+    filename = str(tmp_path / "export.json")
+    result = runner.invoke(
+        app, ["export", "--url", fake_couch.url, "--index", filename, MASTER_DB]
+    )
+    assert result.exit_code == 0
+
+    # the same index as the one built from the finished file
+    result = runner.invoke(
+        app, ["index", "--index-file", f"{filename}.rebuilt", filename]
+    )
+    assert result.exit_code == 0
+    with open(f"{filename}.idx", "rb") as inf, open(
+        f"{filename}.rebuilt", "rb"
+    ) as inf2:
+        assert inf.read() == inf2.read()
+
+    # sorted runs spilled to disk merge into the same index
+    with IndexWriter(f"{filename}.runs", run_entries=2) as writer:
+        for doc_id, offset, length in reversed(list(iter_line_offsets(filename))):
+            writer.add(doc_id, offset, length)
+        assert writer.finish(os.path.getsize(filename)) == len(DOCS)
+    with open(f"{filename}.idx", "rb") as inf, open(f"{filename}.runs", "rb") as inf2:
+        assert inf.read() == inf2.read()
+
+
+def test_block_file_export_and_filter():
+    data = """
+{"total_rows":3,"offset":0,"rows":[
+{"id":"test_a_1","key":"test_a_1","value":{"rev":"3-825cb35de44c433bfb2df415563a19de"},"doc":{"_id":"test_a_1","_rev":"3-825cb35de44c433bfb2df415563a19de"}},
+{"id":"test_b_1","key":"test_b_1","value":{"rev":"1-c3d84a0ca6114a8e8fbef75dc8c7be00"},"doc":{"_id":"test_b_1","_rev":"1-c3d84a0ca6114a8e8fbef75dc8c7be00","test":"test"}},
+{"id":"test_a_2","key":"test_a_2","value":{"rev":"15-305afde91ffef71edcff06458e17c186"},"doc":{"_id":"test_a_2","_rev":"15-305afde91ffef71edcff06458e17c186","test":"test"}}
+]}
+    """.strip()
+
+    with NamedTemporaryFile() as tmpfile1:
+        filename1 = tmpfile1.name
+        print(filename1)
+    with NamedTemporaryFile(suffix=".fmb") as tmpfile2:
+        filename2 = tmpfile2.name
+        print(filename2)
+    with NamedTemporaryFile() as tmpfile_filter:
+        filename_filter = tmpfile_filter.name
+        print(filename_filter)
+    with NamedTemporaryFile(suffix=".fmb") as tmpfile_outfile:
+        filename_outfile = tmpfile_outfile.name
+        print(filename_outfile)
+
+    with open(filename1, "w", encoding="utf8") as inf:
+        inf.write(data)
+
+    result = runner.invoke(app, ["export_from_all_docs_file", filename1, filename2])
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open_file(filename2, "rb") as inf:
+        assert [json.loads(line)["_id"] for line in inf] == [
+            "test_a_1",
+            "test_b_1",
+            "test_a_2",
+        ]
+
+    with open(filename_filter, "w", encoding="utf-8") as inf:
+        filter_ = [{"filepath": filename_outfile, "regex_filters": ["^.*?_a_\\d+$"]}]
+        inf.write(json.dumps(filter_, ensure_ascii=False, indent=4))
+
+    result = runner.invoke(
+        app, ["filter", "--workers", "2", filename_filter, filename2]
+    )
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open_file(filename_outfile, "rb") as outf:
+        assert [json.loads(line)["_id"] for line in outf] == ["test_a_1", "test_a_2"]
+
+
 def test_filter():
     with NamedTemporaryFile() as tmpfile_filter:
         filename_filter = tmpfile_filter.name
@@ -506,3 +756,1168 @@ def test_filter():
 {"_id": "test_c_1", "_rev": "1-967a00dff5e02add41819138abb3284d"}
 """.lstrip()
         assert expected_output_2 == outf2.read()
+
+
+def test_filter_single_pass():
+    with NamedTemporaryFile() as tmpfile_filter:
+        filename_filter = tmpfile_filter.name
+        print(filename_filter)
+
+    with NamedTemporaryFile() as tmpfile_outfile:
+        filename_outfile = tmpfile_outfile.name
+        print(filename_outfile)
+
+    with NamedTemporaryFile() as tmpfile_infile:
+        filename_infile = tmpfile_infile.name
+        print(filename_infile)
+
+    # both entries write into the same file, a doc matching both is written once
+    with open(filename_filter, "w", encoding="utf-8") as inf:
+        filter_ = [
+            {"filepath": filename_outfile, "regex_filters": ["^.*?_a_\\d+$"]},
+            {"filepath": filename_outfile, "regex_filters": ["^test_", "(x)\\1"]},
+        ]
+        inf.write(json.dumps(filter_, ensure_ascii=False, indent=4))
+
+    data = """
+{"_id":"test_a_1","_rev":"3-825cb35de44c433bfb2df415563a19de","ü":"ä"}
+{"_id": "xx_b_1", "_rev": "4-f6647f1364a5944f9dcd3b9bf77329bd", "test": "b"}
+{"_id": "other_c_1", "_rev": "1-967a00dff5e02add41819138abb3284d"}
+""".strip()
+    with open(filename_infile, "w", encoding="utf-8") as inf:
+        inf.write(data)
+
+    result = runner.invoke(app, ["filter", filename_filter, filename_infile])
+
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open(filename_outfile, "r", encoding="utf-8") as outf:
+        assert outf.read() == "\n".join(data.splitlines()[:2]) + "\n"
+
+
+def test_filter_unmatched_file():
+    with NamedTemporaryFile() as tmpfile_filter:
+        filename_filter = tmpfile_filter.name
+        print(filename_filter)
+
+    with NamedTemporaryFile() as tmpfile_outfile:
+        filename_outfile = tmpfile_outfile.name
+        print(filename_outfile)
+
+    with NamedTemporaryFile() as tmpfile_unmatched:
+        filename_unmatched = tmpfile_unmatched.name
+        print(filename_unmatched)
+
+    with NamedTemporaryFile() as tmpfile_infile:
+        filename_infile = tmpfile_infile.name
+        print(filename_infile)
+
+    with open(filename_filter, "w", encoding="utf-8") as inf:
+        filter_ = [{"filepath": filename_outfile, "regex_filters": ["^.*?_a_\\d+$"]}]
+        inf.write(json.dumps(filter_, ensure_ascii=False, indent=4))
+
+    with open(filename_infile, "w", encoding="utf-8") as inf:
+        data = """
+{"_id": "test_a_1", "_rev": "3-825cb35de44c433bfb2df415563a19de"}
+{"_id": "test_b_1", "_rev": "4-f6647f1364a5944f9dcd3b9bf77329bd", "test": "b"}
+{"_id": "test_c_1", "_rev": "1-967a00dff5e02add41819138abb3284d"}
+""".strip()
+        inf.write(data)
+
+    result = runner.invoke(
+        app,
+        [
+            "filter",
+            "--unmatched-file",
+            filename_unmatched,
+            filename_filter,
+            filename_infile,
+        ],
+    )
+
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open(filename_unmatched, "r", encoding="utf-8") as outf:
+        expected_output = """
+{"_id": "test_b_1", "_rev": "4-f6647f1364a5944f9dcd3b9bf77329bd", "test": "b"}
+{"_id": "test_c_1", "_rev": "1-967a00dff5e02add41819138abb3284d"}
+""".lstrip()
+        assert outf.read() == expected_output
+
+
+def test_filter_workers():
+    with NamedTemporaryFile() as tmpfile_filter:
+        filename_filter = tmpfile_filter.name
+        print(filename_filter)
+
+    with NamedTemporaryFile() as tmpfile_outfile:
+        filename_outfile = tmpfile_outfile.name
+        print(filename_outfile)
+
+    with NamedTemporaryFile() as tmpfile_infile:
+        filename_infile = tmpfile_infile.name
+        print(filename_infile)
+
+    with open(filename_filter, "w", encoding="utf-8") as inf:
+        filter_ = [{"filepath": filename_outfile, "regex_filters": ["^.*?_a_\\d+$"]}]
+        inf.write(json.dumps(filter_, ensure_ascii=False, indent=4))
+
+    lines = [
+        json.dumps({"_id": f"test_{'ab'[i % 2]}_{i}", "test": "x" * i}) + "\n"
+        for i in range(100)
+    ]
+    with open(filename_infile, "w", encoding="utf-8") as inf:
+        inf.write("".join(lines))
+
+    result = runner.invoke(
+        app, ["filter", "--workers", "3", filename_filter, filename_infile]
+    )
+
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open(filename_outfile, "r", encoding="utf-8") as outf:
+        assert outf.read() == "".join(lines[::2])
+    assert not os.path.exists(f"{filename_outfile}.part0")
+
+
+def test_filter_id_layouts():
+    with NamedTemporaryFile() as tmpfile_filter:
+        filename_filter = tmpfile_filter.name
+        print(filename_filter)
+
+    with NamedTemporaryFile() as tmpfile_outfile:
+        filename_outfile = tmpfile_outfile.name
+        print(filename_outfile)
+
+    with NamedTemporaryFile() as tmpfile_infile:
+        filename_infile = tmpfile_infile.name
+        print(filename_infile)
+
+    with open(filename_filter, "w", encoding="utf-8") as inf:
+        filter_ = [{"filepath": filename_outfile, "regex_filters": ['^a_"_\\d+$']}]
+        inf.write(json.dumps(filter_, ensure_ascii=False, indent=4))
+
+    # escaped ids and docs without _id as first key need the full json parser
+    data = """
+{"_id": "a_\\"_1", "_rev": "3-825cb35de44c433bfb2df415563a19de"}
+{"_id":"a_b_2","_rev":"1-34333f0454a81dc3559c356a5df072fc"}
+{"_rev": "4-f6647f1364a5944f9dcd3b9bf77329bd", "_id": "a_\\u0022_3"}
+{"_id": "a_\\u0022x_4", "_rev": "2-7051cbe5c8faecd085a3fa619e6e6337"}
+""".strip()
+    with open(filename_infile, "w", encoding="utf-8") as inf:
+        inf.write(data)
+
+    result = runner.invoke(app, ["filter", filename_filter, filename_infile])
+
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open(filename_outfile, "r", encoding="utf-8") as outf:
+        expected_output = [data.splitlines()[0], data.splitlines()[2]]
+        assert outf.read() == "\n".join(expected_output) + "\n"
+
+
+def test_export_paginated(setup_masterdb, drop_dbs):
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--page-size",
+            "3",
+            filename,
+            MASTER_DB,
+        ],
+    )
+    data = []
+    with open(filename, "r", encoding="utf8") as inf:
+        for line in inf:
+            doc = json.loads(line)
+            rev_num = get_rev_num_from_doc(doc)
+            del doc["_rev"]
+            data.append((rev_num, doc))
+
+    assert result.exit_code == 0
+
+    assert len(data) == len(DOCS)
+    assert data == DOCS
+
+
+def test_export_stream(setup_masterdb, drop_dbs):
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--stream",
+            filename,
+            MASTER_DB,
+        ],
+    )
+    data = []
+    with open(filename, "r", encoding="utf8") as inf:
+        for line in inf:
+            doc = json.loads(line)
+            rev_num = get_rev_num_from_doc(doc)
+            del doc["_rev"]
+            data.append((rev_num, doc))
+
+    assert result.exit_code == 0
+
+    assert len(data) == len(DOCS)
+    assert data == DOCS
+
+
+def test_import_batched(setup_masterdb, drop_dbs):
+    data = [
+        {"_id": "testdoc_1", "_rev": "3-825cb35de44c433bfb2df415563a19de"},
+        {
+            "_id": "testdoc_2",
+            "_rev": "1-c3d84a0ca6114a8e8fbef75dc8c7be00",
+            "test": "test",
+        },
+        {
+            "_id": "testdoc_3",
+            "_rev": "15-305afde91ffef71edcff06458e17c186",
+            "test": "test",
+            "another": "test",
+        },
+        {"_id": "testdoc_4", "_rev": "1-967a00dff5e02add41819138abb3284d"},
+    ]
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    with open(filename, "w", encoding="utf8") as inf:
+        inf.write("\n".join(json.dumps(x) for x in data))
+
+    result = runner.invoke(
+        app,
+        [
+            "import",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--batch-size",
+            "3",
+            "--batch-bytes",
+            "150",
+            filename,
+            "import_testdb",
+        ],
+    )
+
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with sessions.BaseUrlSession(
+        base_url="http://localhost:5984/import_testdb/",
+    ) as client:
+        client.auth = ("admin", "adminadmin")
+        assert len(data) == client.get("").json()["doc_count"]
+        for doc in data:
+            response = client.get(doc["_id"])
+            assert response.status_code == 200
+            assert doc == response.json()
+
+
+def test_import_replay_revisions(setup_masterdb, drop_dbs):
+    data = [
+        {"_id": "testdoc_1", "_rev": "3-825cb35de44c433bfb2df415563a19de"},
+        {
+            "_id": "testdoc_2",
+            "_rev": "1-c3d84a0ca6114a8e8fbef75dc8c7be00",
+            "test": "test",
+        },
+        {
+            "_id": "testdoc_3",
+            "_rev": "15-305afde91ffef71edcff06458e17c186",
+            "test": "test",
+            "another": "test",
+        },
+        {"_id": "testdoc_4", "_rev": "1-967a00dff5e02add41819138abb3284d"},
+    ]
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    with open(filename, "w", encoding="utf8") as inf:
+        inf.write("\n".join(json.dumps(x) for x in data))
+
+    result = runner.invoke(
+        app,
+        [
+            "import",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--replay-revisions",
+            filename,
+            "import_testdb",
+        ],
+    )
+
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with sessions.BaseUrlSession(
+        base_url="http://localhost:5984/import_testdb/",
+    ) as client:
+        client.auth = ("admin", "adminadmin")
+        assert len(data) == client.get("").json()["doc_count"]
+        for doc in data:
+            response = client.get(doc["_id"], params={"revs": "true"})
+            assert response.status_code == 200
+            response_json = response.json()
+            assert response_json["_revisions"]["start"] == get_rev_num_from_doc(doc)
+            del response_json["_revisions"]
+            assert doc == response_json
+
+
+def test_import_workers(setup_masterdb, drop_dbs):
+    data = [
+        {"_id": "testdoc_1", "_rev": "3-825cb35de44c433bfb2df415563a19de"},
+        {
+            "_id": "testdoc_2",
+            "_rev": "1-c3d84a0ca6114a8e8fbef75dc8c7be00",
+            "test": "test",
+        },
+        {
+            "_id": "testdoc_3",
+            "_rev": "15-305afde91ffef71edcff06458e17c186",
+            "test": "test",
+            "another": "test",
+        },
+        {"_id": "testdoc_4", "_rev": "1-967a00dff5e02add41819138abb3284d"},
+    ]
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    with open(filename, "w", encoding="utf8") as inf:
+        inf.write("\n".join(json.dumps(x) for x in data))
+
+    result = runner.invoke(
+        app,
+        [
+            "import",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--batch-size",
+            "1",
+            "--workers",
+            "3",
+            filename,
+            "import_testdb",
+        ],
+    )
+
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with sessions.BaseUrlSession(
+        base_url="http://localhost:5984/import_testdb/",
+    ) as client:
+        client.auth = ("admin", "adminadmin")
+        assert len(data) == client.get("").json()["doc_count"]
+        for doc in data:
+            response = client.get(doc["_id"])
+            assert response.status_code == 200
+            assert doc == response.json()
+
+
+def test_export_workers(setup_masterdb, drop_dbs):
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--workers",
+            "3",
+            filename,
+            MASTER_DB,
+        ],
+    )
+    data = []
+    with open(filename, "r", encoding="utf8") as inf:
+        for line in inf:
+            doc = json.loads(line)
+            rev_num = get_rev_num_from_doc(doc)
+            del doc["_rev"]
+            data.append((rev_num, doc))
+
+    assert result.exit_code == 0
+
+    assert len(data) == len(DOCS)
+    assert data == DOCS
+
+
+def test_export_since_and_import_delta(setup_masterdb, drop_dbs):
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    with NamedTemporaryFile() as tmpfile:
+        filename_delta = tmpfile.name
+        print(filename_delta)
+
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--since",
+            "0",
+            filename,
+            MASTER_DB,
+        ],
+    )
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open(filename, "r", encoding="utf8") as inf:
+        assert len(inf.readlines()) == len(DOCS)
+
+    with open(f"{filename}.seq", "r", encoding="utf8") as inf:
+        assert json.loads(inf.read())["db"] == MASTER_DB
+
+    # nothing changed since the last export
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--since-checkpoint",
+            f"{filename}.seq",
+            filename_delta,
+            MASTER_DB,
+        ],
+    )
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with open(filename_delta, "r", encoding="utf8") as inf:
+        assert inf.read() == ""
+
+    result = runner.invoke(
+        app,
+        [
+            "import",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--delta",
+            filename,
+            "import_testdb",
+        ],
+    )
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with sessions.BaseUrlSession(
+        base_url="http://localhost:5984/import_testdb/",
+    ) as client:
+        client.auth = ("admin", "adminadmin")
+        assert len(DOCS) == client.get("").json()["doc_count"]
+        for _, doc in DOCS:
+            response = client.get(doc["_id"])
+            assert response.status_code == 200
+            response_json = response.json()
+            del response_json["_rev"]
+            assert doc == response_json
+
+
+def test_export_since_checkpoint(fake_couch, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # a file named like the sequence doesn't change what --since means
+    with open("0", "w", encoding="utf8") as outf:
+        outf.write("{}")
+
+    result = runner.invoke(
+        app, ["export", "--url", fake_couch.url, "--since", "0", "full.json", MASTER_DB]
+    )
+    assert result.exit_code == 0
+    with open("full.json", "r", encoding="utf8") as inf:
+        assert len(inf.readlines()) == len(DOCS)
+
+    fake_couch.put_doc(MASTER_DB, {"_id": "testdoc_new"})
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--url",
+            fake_couch.url,
+            "--since-checkpoint",
+            "full.json.seq",
+            "delta.json",
+            MASTER_DB,
+        ],
+    )
+    assert result.exit_code == 0
+    with open("delta.json", "r", encoding="utf8") as inf:
+        assert [json.loads(line)["_id"] for line in inf] == ["testdoc_new"]
+
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--url",
+            fake_couch.url,
+            "--since-checkpoint",
+            "missing.seq",
+            "delta.json",
+            MASTER_DB,
+        ],
+    )
+    assert result.exit_code == 1
+    assert "Checkpoint missing.seq does not exist. Aborting." in result.stdout
+
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--since",
+            "0",
+            "--since-checkpoint",
+            "full.json.seq",
+            "delta.json",
+            MASTER_DB,
+        ],
+    )
+    assert result.exit_code == 1
+    assert "--since can not be combined with --since-checkpoint." in result.stdout
+
+
+def test_import_resume(setup_masterdb, drop_dbs):
+    data = [
+        {"_id": "testdoc_1", "_rev": "3-825cb35de44c433bfb2df415563a19de"},
+        {
+            "_id": "testdoc_2",
+            "_rev": "1-c3d84a0ca6114a8e8fbef75dc8c7be00",
+            "test": "test",
+        },
+        {
+            "_id": "testdoc_3",
+            "_rev": "15-305afde91ffef71edcff06458e17c186",
+            "test": "test",
+            "another": "test",
+        },
+        {"_id": "testdoc_4", "_rev": "1-967a00dff5e02add41819138abb3284d"},
+    ]
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    lines = [json.dumps(x) + "\n" for x in data]
+    with open(filename, "w", encoding="utf8") as inf:
+        inf.write("".join(lines))
+
+    # pretend the first two docs were imported by an interrupted run
+    with open(f"{filename}.checkpoint", "w", encoding="utf8") as outf:
+        checkpoint = {
+            "kind": "import",
+            "filepath": filename,
+            "db": "import_testdb",
+            "offset": len(lines[0]) + len(lines[1]),
+            "batch": 1,
+        }
+        outf.write(json.dumps(checkpoint))
+
+    result = runner.invoke(
+        app,
+        [
+            "import",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--batch-size",
+            "1",
+            "--resume",
+            filename,
+            "import_testdb",
+        ],
+    )
+
+    print(result.stdout)
+    assert result.exit_code == 0
+
+    with sessions.BaseUrlSession(
+        base_url="http://localhost:5984/import_testdb/",
+    ) as client:
+        client.auth = ("admin", "adminadmin")
+        assert 2 == client.get("").json()["doc_count"]
+        for doc in data[2:]:
+            response = client.get(doc["_id"])
+            assert response.status_code == 200
+            assert doc == response.json()
+
+    assert not os.path.exists(f"{filename}.checkpoint")
+
+
+def test_export_resume(setup_masterdb, drop_dbs):
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    # pretend an interrupted run wrote the first doc and half of the second one
+    first_line = json.dumps({"_id": "testdoc_1", "_rev": "3-abc"}) + "\n"
+    with open(filename, "w", encoding="utf8") as outf:
+        outf.write(first_line + '{"_id": "testdoc_2", "_r')
+
+    with open(f"{filename}.checkpoint", "w", encoding="utf8") as outf:
+        checkpoint = {
+            "kind": "export",
+            "filepath": filename,
+            "db": MASTER_DB,
+            "offset": len(first_line),
+            "last_id": "testdoc_1",
+        }
+        outf.write(json.dumps(checkpoint))
+
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--user",
+            "admin",
+            "--password",
+            "adminadmin",
+            "--resume",
+            filename,
+            MASTER_DB,
+        ],
+    )
+    data = []
+    with open(filename, "r", encoding="utf8") as inf:
+        for line in inf:
+            doc = json.loads(line)
+            rev_num = get_rev_num_from_doc(doc)
+            del doc["_rev"]
+            data.append((rev_num, doc))
+
+    assert result.exit_code == 0
+
+    assert len(data) == len(DOCS)
+    assert data == DOCS
+    assert not os.path.exists(f"{filename}.checkpoint")
+
+
+@pytest.mark.parametrize("page_size", [None, 1])
+def test_export_resume_after_the_last_doc_was_deleted(fake_couch, tmp_path, page_size):
+    filename = str(tmp_path / "export.json")
+    lines = [
+        json.dumps({"_id": "testdoc_1", "_rev": "3-abc"}) + "\n",
+        json.dumps({"_id": "testdoc_2", "_rev": "1-abc"}) + "\n",
+    ]
+    with open(filename, "w", encoding="utf8") as outf:
+        outf.write("".join(lines))
+
+    with open(f"{filename}.checkpoint", "w", encoding="utf8") as outf:
+        checkpoint = {
+            "kind": "export",
+            "filepath": filename,
+            "db": MASTER_DB,
+            "offset": len("".join(lines)),
+            "last_id": "testdoc_2",
+        }
+        outf.write(json.dumps(checkpoint))
+
+    # the next doc after the checkpoint must not be skipped in its place
+    fake_couch.delete_doc(MASTER_DB, "testdoc_2")
+    options = [] if page_size is None else ["--page-size", str(page_size)]
+    result = runner.invoke(
+        app,
+        ["export", "--url", fake_couch.url, "--resume", *options, filename, MASTER_DB],
+    )
+    assert result.exit_code == 0
+
+    with open(filename, "r", encoding="utf8") as inf:
+        assert [json.loads(line)["_id"] for line in inf] == [
+            "testdoc_1",
+            "testdoc_2",
+            "testdoc_3",
+            "testdoc_4",
+        ]
+
+
+def test_page_turn_after_the_last_doc_was_deleted(fake_couch):
+    config = Config(fake_couch.url)
+    couch = CouchDb(config)
+    doc_ids = []
+    for doc in couch.get_all_docs(MASTER_DB, page_size=1):
+        doc_ids.append(doc["_id"])
+        # deleted between two pages, the next doc must not be skipped in its place
+        if doc["_id"] == "testdoc_1":
+            fake_couch.delete_doc(MASTER_DB, "testdoc_1")
+    couch.close()
+    assert doc_ids == ["testdoc_1", "testdoc_2", "testdoc_3", "testdoc_4"]
+
+    async def get_doc_ids():
+        doc_ids = []
+        async with AsyncCouchDb(config) as client:
+            async for doc in client.get_all_docs(MASTER_DB, page_size=1):
+                doc_ids.append(doc["_id"])
+                if doc["_id"] == "testdoc_2":
+                    fake_couch.delete_doc(MASTER_DB, "testdoc_2")
+        return doc_ids
+
+    assert asyncio.run(get_doc_ids()) == ["testdoc_2", "testdoc_3", "testdoc_4"]
+
+
+def test_import_resume_rejects_export_checkpoint(fake_couch, tmp_path):
+    filename = str(tmp_path / "export.json")
+    result = runner.invoke(
+        app, ["export", "--url", fake_couch.url, filename, MASTER_DB]
+    )
+    assert result.exit_code == 0
+
+    # an interrupted export leaves its checkpoint at the default path of import
+    with open(f"{filename}.checkpoint", "w", encoding="utf8") as outf:
+        checkpoint = {
+            "kind": "export",
+            "filepath": filename,
+            "db": MASTER_DB,
+            "offset": 0,
+            "last_id": None,
+        }
+        outf.write(json.dumps(checkpoint))
+
+    result = runner.invoke(
+        app, ["import", "--url", fake_couch.url, "--resume", filename, MASTER_DB]
+    )
+    assert result.exit_code == 1
+    assert (
+        f"Checkpoint {filename}.checkpoint is not an import checkpoint. Aborting."
+        in result.stdout
+    )
+
+
+def test_unwritable_checkpoint_does_not_stop_import_or_export(fake_couch, tmp_path):
+    filename = str(tmp_path / "export.json")
+    checkpoint_file = str(tmp_path / "missing" / "checkpoint")
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--url",
+            fake_couch.url,
+            "--page-size",
+            "1",
+            "--checkpoint-file",
+            checkpoint_file,
+            filename,
+            MASTER_DB,
+        ],
+    )
+    assert result.exit_code == 0
+
+    result = runner.invoke(
+        app,
+        [
+            "import",
+            "--url",
+            fake_couch.url,
+            "--batch-size",
+            "1",
+            "--checkpoint-file",
+            checkpoint_file,
+            filename,
+            "checkpoint_testdb",
+        ],
+    )
+    assert result.exit_code == 0
+    assert len(fake_couch.get_docs("checkpoint_testdb")) == len(DOCS)
+
+
+def test_async_engine(fake_couch):
+    pytest.importorskip("aiohttp")
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    result = runner.invoke(
+        app,
+        [
+            "export",
+            "--url",
+            fake_couch.url,
+            "--engine",
+            "asyncio",
+            "--workers",
+            "2",
+            filename,
+            MASTER_DB,
+        ],
+    )
+    assert result.exit_code == 0
+
+    data = []
+    with open(filename, "r", encoding="utf8") as inf:
+        for line in inf:
+            doc = json.loads(line)
+            rev_num = get_rev_num_from_doc(doc)
+            del doc["_rev"]
+            data.append((rev_num, doc))
+    assert data == DOCS
+
+    result = runner.invoke(
+        app,
+        [
+            "import",
+            "--url",
+            fake_couch.url,
+            "--engine",
+            "asyncio",
+            "--workers",
+            "2",
+            "--batch-size",
+            "1",
+            filename,
+            "async_testdb",
+        ],
+    )
+    assert result.exit_code == 0
+
+    imported = []
+    for doc in sorted(
+        fake_couch.get_docs("async_testdb").values(), key=lambda x: x["_id"]
+    ):
+        rev_num = get_rev_num_from_doc(doc)
+        del doc["_rev"]
+        imported.append((rev_num, doc))
+    assert imported == DOCS
+
+
+@pytest.mark.parametrize("accept_gzip", [True, False])
+@pytest.mark.parametrize("engine", ["sync", "asyncio"])
+def test_http_compression(fake_couch, engine, accept_gzip):
+    if engine == "asyncio":
+        pytest.importorskip("aiohttp")
+    fake_couch.accept_gzip = accept_gzip
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    url = ["--url", fake_couch.url, "--engine", engine, "--http-compression"]
+    result = runner.invoke(app, ["export", *url, filename, MASTER_DB])
+    assert result.exit_code == 0
+    assert fake_couch.gzip_responses > 0
+
+    result = runner.invoke(app, ["import", *url, filename, "gzip_testdb"])
+    assert result.exit_code == 0
+    assert (fake_couch.gzip_requests > 0) == accept_gzip
+
+    imported = []
+    for doc in sorted(
+        fake_couch.get_docs("gzip_testdb").values(), key=lambda x: x["_id"]
+    ):
+        rev_num = get_rev_num_from_doc(doc)
+        del doc["_rev"]
+        imported.append((rev_num, doc))
+    assert imported == DOCS
+
+
+@pytest.mark.parametrize("engine", ["sync", "asyncio"])
+def test_import_splits_too_large_batches(fake_couch, engine):
+    if engine == "asyncio":
+        pytest.importorskip("aiohttp")
+    data = [{"_id": f"testdoc_{i}", "test": "x" * 100} for i in range(50)]
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    with open(filename, "w", encoding="utf8") as inf:
+        inf.write("\n".join(json.dumps(x) for x in data))
+
+    # a batch of all docs is far above the limit, but single docs fit
+    fake_couch.max_request_size = 1000
+    result = runner.invoke(
+        app,
+        [
+            "import",
+            "--url",
+            fake_couch.url,
+            "--engine",
+            engine,
+            "--adaptive-batching",
+            filename,
+            "split_testdb",
+        ],
+    )
+    assert result.exit_code == 0
+
+    imported = fake_couch.get_docs("split_testdb")
+    assert sorted(imported) == sorted(doc["_id"] for doc in data)
+
+    fake_couch.max_request_size = 100
+    result = runner.invoke(
+        app, ["import", "--url", fake_couch.url, filename, "split_testdb_2"]
+    )
+    assert result.exit_code == 1
+    assert "is too large for" in result.stdout
+
+
+def test_copy(fake_couch):
+    result = runner.invoke(
+        app,
+        [
+            "copy",
+            "--page-size",
+            "1",
+            f"{fake_couch.url}{MASTER_DB}",
+            f"{fake_couch.url}copy_testdb",
+        ],
+    )
+    assert result.exit_code == 0
+
+    copied = []
+    for doc in sorted(
+        fake_couch.get_docs("copy_testdb").values(), key=lambda x: x["_id"]
+    ):
+        rev_num = get_rev_num_from_doc(doc)
+        del doc["_rev"]
+        copied.append((rev_num, doc))
+    assert copied == DOCS
+
+    result = runner.invoke(app, ["copy", f"{fake_couch.url}{MASTER_DB}", "copy_testdb"])
+    assert result.exit_code == 1
+    assert "copy_testdb is not of the form URL/DB." in result.stdout
+
+    result = runner.invoke(
+        app,
+        ["copy", f"{fake_couch.url}missing_testdb", f"{fake_couch.url}copy_testdb2"],
+    )
+    assert result.exit_code == 1
+    assert "Database missing_testdb does not exist. Aborting." in result.stdout
+    assert "copy_testdb2" not in fake_couch.dbs
+
+    # each side has its own connection options, e.g. only the target compresses
+    source = f"{fake_couch.url}{MASTER_DB}"
+    result = runner.invoke(
+        app,
+        [
+            "copy",
+            "--http-compression",
+            "--no-target-http-compression",
+            source,
+            f"{fake_couch.url}copy_testdb3",
+        ],
+    )
+    assert result.exit_code == 0
+    assert fake_couch.gzip_requests == 0
+
+    result = runner.invoke(
+        app,
+        [
+            "copy",
+            "--target-http-compression",
+            "--target-timeout",
+            "5",
+            source,
+            f"{fake_couch.url}copy_testdb4",
+        ],
+    )
+    assert result.exit_code == 0
+    assert fake_couch.gzip_requests > 0
+    assert len(fake_couch.get_docs("copy_testdb4")) == len(DOCS)
+
+
+def test_stats_file(fake_couch):
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    stats_file = f"{filename}.stats.json"
+    prometheus_file = f"{filename}.prom"
+    result = runner.invoke(
+        app,
+        [
+            "--stats-file",
+            stats_file,
+            "--prometheus-file",
+            prometheus_file,
+            "export",
+            "--url",
+            fake_couch.url,
+            filename,
+            MASTER_DB,
+        ],
+    )
+    assert result.exit_code == 0
+
+    with open(stats_file, "r", encoding="utf8") as inf:
+        stats = json.load(inf)
+    assert stats["docs"] == len(DOCS)
+    assert stats["requests"]["GET _all_docs"]["count"] == 1
+    assert stats["requests"]["GET _all_docs"]["latency_seconds_buckets"]["+Inf"] == 1
+    assert stats["bytes_received"] > 0
+
+    with open(prometheus_file, "r", encoding="utf8") as inf:
+        assert f"furniture_mover_docs_total {len(DOCS)}\n" in inf.read()
+
+    result = runner.invoke(
+        app,
+        [
+            "--stats-file",
+            stats_file,
+            "import",
+            "--url",
+            fake_couch.url,
+            filename,
+            "stats_testdb",
+        ],
+    )
+    assert result.exit_code == 0
+
+    with open(stats_file, "r", encoding="utf8") as inf:
+        stats = json.load(inf)
+    assert stats["docs"] == len(DOCS)
+    # one insert and one update for every further revision of the newest doc
+    assert stats["batches"]["count"] == max(rev for rev, _ in DOCS)
+    assert stats["batches"]["max_docs"] == len(DOCS)
+
+
+def test_benchmarks():
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    result = runner.invoke(
+        benchmarks_app,
+        ["--docs", "20", "--doc-size", "10", "--revisions", "2", "--output", filename],
+    )
+    assert result.exit_code == 0
+
+    with open(filename, "r", encoding="utf8") as inf:
+        results = json.load(inf)["results"]
+    assert [result["scenario"] for result in results] == [
+        scenario.value for scenario in Scenario
+    ]
+    assert all(result["docs"] == 20 for result in results)
+    assert all(result["peak_memory_mb"] > 0 for result in results)
+
+
+def test_profile(fake_couch):
+    with NamedTemporaryFile() as tmpfile:
+        filename = tmpfile.name
+        print(filename)
+
+    memory_file = f"{filename}.memory.txt"
+    result = runner.invoke(
+        app,
+        [
+            "--profile",
+            "memory",
+            "--profile-file",
+            memory_file,
+            "export",
+            "--url",
+            fake_couch.url,
+            filename,
+            MASTER_DB,
+        ],
+    )
+    assert result.exit_code == 0
+    with open(memory_file, "r", encoding="utf8") as inf:
+        assert "top 25 allocations" in inf.read()
+
+    cpu_file = f"{filename}.prof"
+    stats_file = f"{filename}.stats.json"
+    result = runner.invoke(
+        app,
+        [
+            "--profile",
+            "cpu",
+            "--profile-file",
+            cpu_file,
+            "--stats-file",
+            stats_file,
+            "import",
+            "--url",
+            fake_couch.url,
+            filename,
+            "profile_testdb",
+        ],
+    )
+    assert result.exit_code == 0
+    assert "insert_all_docs" in str(pstats.Stats(cpu_file).stats)
+
+    with open(stats_file, "r", encoding="utf8") as inf:
+        spans = json.load(inf)["spans"]
+    assert spans["create_db"]["count"] == 1
+    assert spans["insert_initial"]["count"] == 1
+    # one update round for every further revision of the newest doc
+    assert spans["insert_revision"]["count"] == max(rev for rev, _ in DOCS) - 1
+
+    # the parts of export --workers are written in the threads of a pool
+    result = runner.invoke(
+        app,
+        [
+            "--profile",
+            "cpu",
+            "--profile-file",
+            cpu_file,
+            "export",
+            "--url",
+            fake_couch.url,
+            "--workers",
+            "2",
+            f"{filename}.workers",
+            MASTER_DB,
+        ],
+    )
+    assert result.exit_code == 0
+    assert "_save_docs" in str(pstats.Stats(cpu_file).stats)
+
+    result = runner.invoke(
+        app,
+        [
+            "--profile",
+            "cpu",
+            "--profile-file",
+            cpu_file,
+            "filter",
+            "--workers",
+            "2",
+            filename,
+            filename,
+        ],
+    )
+    assert result.exit_code == 1
+    assert "--profile cpu can not be combined with filter --workers." in result.stdout